@@ -23,6 +23,23 @@ interface ApiResponse {
   }>
 }
 
+// Parse one Server-Sent Event block ("event: ...\ndata: ...") from /analyze/stream
+function parseSseEvent(raw: string): { event: string; data: any } | null {
+  let event = "message"
+  const dataLines: string[] = []
+  for (const line of raw.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim()
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice(5).trim())
+    }
+  }
+  if (dataLines.length === 0) {
+    return null
+  }
+  return { event, data: JSON.parse(dataLines.join("\n")) }
+}
+
 // Clinical trial type
 interface ClinicalTrial {
   title: string
@@ -246,13 +263,13 @@ What are the key factors to make this a success?`
 
       // Log the curl command equivalent
       console.log(`
-        curl -X POST "http://localhost:8000/analyze" \\
+        curl -N -X POST "http://localhost:8000/analyze/stream" \\
           -H "Content-Type: application/json" \\
           -d '${JSON.stringify(payload)}'
       `)
 
-      // Make the API call
-      const response = await fetch("http://localhost:8000/analyze", {
+      // Make the API call; the response streams clinical trials first, then answer tokens
+      const response = await fetch("http://localhost:8000/analyze/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -260,29 +277,68 @@ What are the key factors to make this a success?`
         body: JSON.stringify(payload),
       })
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`API request failed with status ${response.status}`)
       }
 
-      const data: ApiResponse = await response.json()
+      const resultId = messages.length + 3
+      let answer = ""
+      let answerShown = false
+
+      // Add the answer to the chat on the first token, then keep updating it
+      const showAnswer = (text: string) => {
+        answer = text
+        if (!answerShown) {
+          answerShown = true
+          setIsLoading(false)
+          setMessages((prev) => [...prev, { id: resultId, text, sender: "bot" as const }])
+        } else {
+          setMessages((prev) => prev.map((message) => (message.id === resultId ? { ...message, text } : message)))
+        }
+      }
 
-      // Check if clinical trials exist in the response
-      if (data.clinical_trials && data.clinical_trials.length > 0) {
-        setClinicalTrials(data.clinical_trials)
-        setShowTrials(true)
-      } else {
-        setClinicalTrials([])
-        setShowTrials(false)
+      const handleEvent = (event: string, data: any) => {
+        if (event === "clinical_trials") {
+          // Check if clinical trials exist in the response
+          if (data.clinical_trials && data.clinical_trials.length > 0) {
+            setClinicalTrials(data.clinical_trials)
+            setShowTrials(true)
+          } else {
+            setClinicalTrials([])
+            setShowTrials(false)
+          }
+        } else if (event === "token") {
+          showAnswer(answer + data.text)
+        } else if (event === "done") {
+          showAnswer(data.answer)
+        } else if (event === "error") {
+          throw new Error(data.detail)
+        }
       }
 
-      // Add the response to the chat
-      const resultMessage = {
-        id: messages.length + 3,
-        text: data.answer,
-        sender: "bot" as const,
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ""
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) {
+          break
+        }
+        buffer += decoder.decode(value, { stream: true })
+
+        // Events are separated by a blank line
+        let separator = buffer.indexOf("\n\n")
+        while (separator !== -1) {
+          const parsed = parseSseEvent(buffer.slice(0, separator))
+          buffer = buffer.slice(separator + 2)
+          if (parsed) {
+            handleEvent(parsed.event, parsed.data)
+          }
+          separator = buffer.indexOf("\n\n")
+        }
       }
 
-      setMessages((prev) => [...prev, resultMessage])
       setConversationStage("followup")
     } catch (error) {
       console.error("Error making API call:", error)
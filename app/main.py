@@ -1,9 +1,19 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routers import medical, index_management
+from app.services.warmup import start_warmup, get_warmup_status
 from app.utils.config import settings
+from app.utils.metrics import render_metrics
 
-app = FastAPI(title="MedMind AI", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load or build the indices in the background so startup isn't blocked
+    start_warmup()
+    yield
+
+app = FastAPI(title="MedMind AI", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,4 +29,15 @@ app.include_router(index_management.router)
 
 @app.get("/")
 async def root():
-    return {"status": "Medical AI Service Running"}
\ No newline at end of file
+    return {"status": "Medical AI Service Running"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the indices are loaded, 503 while warming up."""
+    status = get_warmup_status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, embedding and LLM usage, cache hits and index sizes."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,16 +1,28 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class MedicalQuery(BaseModel):
     symptoms: str
     history: str
 
 class Trial(BaseModel):
+    id: Optional[str] = None
     title: str
     condition: str
     intervention: str
     eligibility: str
 
+class MedicalDocument(BaseModel):
+    id: Optional[str] = None
+    content: str
+    metadata: Optional[Dict[str, Any]] = None
+
 class MedicalResponse(BaseModel):
     answer: str
-    clinical_trials: Optional[List[Trial]] = None
\ No newline at end of file
+    clinical_trials: Optional[List[Trial]] = None
+
+class BatchMedicalResult(MedicalResponse):
+    index: int
+
+class BatchMedicalResponse(BaseModel):
+    results: List[BatchMedicalResult]
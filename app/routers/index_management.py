@@ -1,6 +1,11 @@
-from fastapi import APIRouter, HTTPException, Query
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel
-from app.services.faiss_setup import build_indices, get_indices_status, medical_faiss, clinical_trial_faiss
+from typing import Dict, List, Optional, Union
+from app.models.schemas import MedicalDocument, Trial
+
+# The index services are imported inside the handlers so that importing the
+# app stays cheap; indices are loaded in the background by services.warmup
 
 router = APIRouter(
     prefix="/indices",
@@ -11,61 +16,158 @@ class IndexStatus(BaseModel):
     medical_index_built: bool
     clinical_trials_index_built: bool
     clinical_trials_count: int
+    snapshot_version: Optional[int] = None
+    index_reports: Optional[Dict[str, Dict]] = None
 
 class BuildIndicesResponse(BaseModel):
     medical_index: str
     clinical_trials_index: str
     clinical_trials_count: int
+    snapshot_version: Optional[int] = None
+    index_reports: Optional[Dict[str, Dict]] = None
+
+class BuildJobStatus(BaseModel):
+    id: str
+    state: str  # running, succeeded, failed or cancelled
+    phase: str
+    force: bool
+    created_at: float
+    finished_at: Optional[float] = None
+    elapsed_seconds: float
+    chunks_embedded: int
+    documents_indexed: int
+    progress: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    corpora: Dict[str, Dict[str, Optional[int]]] = {}
+    cancel_requested: bool
+    error: Optional[str] = None
+    result: Optional[Dict] = None
+
+class CorpusUpdateResponse(BaseModel):
+    upserted: List[str]
+    deleted: List[str]
+    not_found: List[str]
+    chunks_added: int
+    chunks_removed: int
+    snapshot_version: Optional[int] = None
     
-@router.post("/build", status_code=200, response_model=BuildIndicesResponse)
-async def build_all_indices(force: bool = Query(False, description="Force rebuilding indices even if they already exist")):
-    """Build all FAISS indices (medical knowledge and clinical trials)."""
-    try:
-        # Check if indices are already built and force is not enabled
-        if not force:
-            status = get_indices_status()
-            if status["medical_index_built"] and status["clinical_trials_index_built"]:
-                return {
-                    "medical_index": "already built, use force=true to rebuild",
-                    "clinical_trials_index": "already built, use force=true to rebuild",
-                    "clinical_trials_count": status["clinical_trials_count"]
-                }
-        
-        # Build the indices
-        status = build_indices()
-        
-        if "error" in status:
-            raise HTTPException(status_code=500, detail=f"Failed to build indices: {status['error']}")
-        
-        # Validate that indices are properly built
-        if medical_faiss is None or clinical_trial_faiss is None:
-            raise HTTPException(
-                status_code=500, 
-                detail="Indices were not properly built despite successful build operation. Check logs for details."
-            )
-            
-        return status
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+@router.post("/build", status_code=202, response_model=Union[BuildJobStatus, BuildIndicesResponse])
+async def build_all_indices(
+    response: Response,
+    force: bool = Query(False, description="Force rebuilding indices even if they already exist"),
+    wait: bool = Query(False, description="Respond only once the build has finished")
+):
+    """Build all FAISS indices (medical knowledge and clinical trials) in the background.
+    
+    Returns the build job (202), whose progress is at /indices/jobs/{id}.
+    If a build is already running, it is joined rather than started again.
+    """
+    from app.services.build_jobs import start_build
+    from app.services.faiss_setup import get_indices_status
+    
+    # Check if indices are already built and force is not enabled
+    if not force:
+        status = get_indices_status()
+        if status["medical_index_built"] and status["clinical_trials_index_built"]:
+            response.status_code = 200
+            return {
+                "medical_index": "already built, use force=true to rebuild",
+                "clinical_trials_index": "already built, use force=true to rebuild",
+                "clinical_trials_count": status["clinical_trials_count"]
+            }
+    
+    job, _ = start_build(force=force)
+    response.headers["Location"] = f"/indices/jobs/{job.id}"
+    if wait:
+        # Wait in a worker thread so the event loop keeps serving other requests
+        await asyncio.to_thread(job.wait)
+        if job.state != "succeeded":
+            raise HTTPException(status_code=500, detail=f"Failed to build indices: {job.error}")
+        response.status_code = 200
+    return job.to_dict()
+
+@router.get("/jobs", response_model=List[BuildJobStatus])
+async def list_build_jobs():
+    """List recent build jobs, newest first."""
+    from app.services.build_jobs import list_jobs
+    
+    return [job.to_dict() for job in list_jobs()]
+
+@router.get("/jobs/{job_id}", response_model=BuildJobStatus)
+async def get_build_job(job_id: str):
+    """Get a build job's state and progress: chunks embedded so far, expected total and ETA."""
+    from app.services.build_jobs import get_job
+    
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown build job {job_id}")
+    return job.to_dict()
+
+@router.post("/jobs/{job_id}/cancel", response_model=BuildJobStatus)
+async def cancel_build_job(job_id: str):
+    """Cancel a running build job. It stops after the current batch, and the current indices stay in place.
+
+    A job that is already saving its snapshot can't be cancelled (409).
+    """
+    from app.services.build_jobs import get_job
+    
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown build job {job_id}")
+    if not job.cancel():
+        raise HTTPException(status_code=409, detail=f"Build job {job_id} can no longer be cancelled ({job.state}, {job.phase})")
+    return job.to_dict()
 
 @router.get("/status", response_model=IndexStatus)
 async def get_status():
     """Get the current status of all indices."""
+    from app.services.faiss_setup import get_indices_status
+    
     try:
-        status = get_indices_status()
-        
-        # Double-check actual objects, not just the status flags
-        if status["medical_index_built"] and medical_faiss is None:
-            status["medical_index_built"] = False
-            
-        if status["clinical_trials_index_built"] and clinical_trial_faiss is None:
-            status["clinical_trials_index_built"] = False
-            
-        return status
+        # Status is read from the published snapshot, so the flags can't disagree with it
+        return get_indices_status()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-@router.post("/rebuild", status_code=200, response_model=BuildIndicesResponse)
-async def rebuild_indices():
+@router.post("/rebuild", status_code=202, response_model=Union[BuildJobStatus, BuildIndicesResponse])
+async def rebuild_indices(
+    response: Response,
+    wait: bool = Query(False, description="Respond only once the build has finished")
+):
     """Convenience endpoint to force rebuild all indices."""
-    return await build_all_indices(force=True) 
\ No newline at end of file
+    return await build_all_indices(response, force=True, wait=wait)
+
+async def update_corpus(corpus, upserts=(), deletes=()):
+    """Apply an incremental corpus update off the event loop."""
+    from app.services.faiss_setup import update_corpus as apply_update
+    
+    try:
+        return await asyncio.to_thread(apply_update, corpus, upserts, deletes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+@router.put("/trials", response_model=CorpusUpdateResponse)
+async def upsert_trials(trials: List[Trial]):
+    """Add or replace clinical trials by ID, embedding only their chunks.
+    
+    Trials without an ID get one derived from their content.
+    """
+    return await update_corpus("clinical_trials", upserts=[trial.model_dump(exclude_none=True) for trial in trials])
+
+@router.delete("/trials", response_model=CorpusUpdateResponse)
+async def delete_trials(ids: List[str] = Query(..., description="IDs of the trials to delete")):
+    """Delete clinical trials by ID."""
+    return await update_corpus("clinical_trials", deletes=ids)
+
+@router.put("/documents", response_model=CorpusUpdateResponse)
+async def upsert_documents(documents: List[MedicalDocument]):
+    """Add or replace medical knowledge documents by ID, embedding only their chunks.
+    
+    Documents without an ID get one derived from their content.
+    """
+    return await update_corpus("medical", upserts=[doc.model_dump(exclude_none=True) for doc in documents])
+
+@router.delete("/documents", response_model=CorpusUpdateResponse)
+async def delete_documents(ids: List[str] = Query(..., description="IDs of the documents to delete")):
+    """Delete medical knowledge documents by ID."""
+    return await update_corpus("medical", deletes=ids)
@@ -1,16 +1,120 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.models.schemas import MedicalQuery, MedicalResponse
-from app.services.llm_service import process_medical_query
+import json
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from app.models.schemas import MedicalQuery, MedicalResponse, BatchMedicalResult, BatchMedicalResponse
+from app.services import warmup
+from app.utils.config import settings
 
 router = APIRouter()
 
+def ensure_not_warming_up():
+    """Reject requests with 503 while the indices are still loading."""
+    if warmup.is_warming_up():
+        raise HTTPException(503, "Indices are still loading, check /ready", headers={"Retry-After": "5"})
+
+def format_sse(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("/analyze", response_model=MedicalResponse)
 async def medical_analysis(
     query: MedicalQuery,
 ):
+    ensure_not_warming_up()
+    
+    # Imported here so the app can start before the index services are loaded
+    from app.services.llm_service import process_medical_query
+    
     try:
         full_query = query.symptoms + " " + query.history
-        response = process_medical_query(full_query)
+        response = await process_medical_query(full_query)
         return MedicalResponse(**response)
     except Exception as e:
-        raise HTTPException(500, f"Analysis failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(500, f"Analysis failed: {str(e)}")
+
+@router.post("/analyze/stream")
+async def medical_analysis_stream(
+    query: MedicalQuery,
+):
+    """Streaming variant of /analyze that sends Server-Sent Events.
+    
+    The clinical trials arrive first (as soon as retrieval is done), followed
+    by the answer tokens as the model generates them.
+    """
+    ensure_not_warming_up()
+    
+    from app.services.llm_service import stream_medical_query
+    
+    full_query = query.symptoms + " " + query.history
+    
+    async def events():
+        async for event, data in stream_medical_query(full_query):
+            yield format_sse(event, data)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so events reach the client immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/analyze/batch", response_model=BatchMedicalResponse)
+async def medical_analysis_batch(
+    queries: List[MedicalQuery],
+    output_format: str = Query("jsonl", alias="format", pattern="^(jsonl|json)$"),
+):
+    """Analyze many queries in one request.
+    
+    Queries are embedded together and each index is searched once per
+    batch, with a bounded number of concurrent LLM completions. By default
+    results stream back in input order as JSON lines
+    ({"index", "answer", "clinical_trials"}); with format=json they are
+    returned together once all are done.
+    """
+    ensure_not_warming_up()
+    if not queries:
+        raise HTTPException(400, "No queries given")
+    if len(queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(413, f"At most {settings.BATCH_MAX_QUERIES} queries per batch")
+    
+    from app.services.llm_service import process_medical_queries
+    
+    full_queries = [query.symptoms + " " + query.history for query in queries]
+    
+    if output_format == "json":
+        try:
+            results = [BatchMedicalResult(index=i, **response) async for i, response in process_medical_queries(full_queries)]
+            return BatchMedicalResponse(results=results)
+        except Exception as e:
+            raise HTTPException(500, f"Batch analysis failed: {str(e)}")
+    
+    async def lines():
+        async for i, response in process_medical_queries(full_queries):
+            yield json.dumps({"index": i, **response}) + "\n"
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/analyze/cache")
+async def answer_cache_stats():
+    """Get semantic answer cache statistics."""
+    from app.services.llm_service import get_answer_cache
+    
+    cache = get_answer_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@router.delete("/analyze/cache")
+async def clear_answer_cache():
+    """Drop all cached answers."""
+    from app.services.llm_service import get_answer_cache
+    
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.clear()
+    return {"cleared": cache is not None}
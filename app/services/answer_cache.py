@@ -0,0 +1,196 @@
+import base64
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+class _Entry:
+    __slots__ = ("version", "variant", "created_at", "response")
+
+    def __init__(self, version, variant, created_at, response):
+        self.version = version
+        self.variant = variant
+        self.created_at = created_at
+        self.response = response
+
+class SemanticAnswerCache:
+    """Caches query responses keyed by the query's normalized embedding.
+
+    A lookup hits when an entry for the same index version and variant
+    (e.g. whether trials were requested) has cosine similarity of at least
+    `threshold` with the query and is younger than `ttl` seconds. At most
+    `maxsize` entries are kept, evicting the least recently used. Entries
+    for other index versions are dropped as soon as a lookup sees a new
+    version, so rebuilds invalidate the cache. With a `path`, entries are
+    also appended to a JSONL file and reloaded on startup. Query texts are
+    never stored, in memory or on disk: an entry is only the query's
+    embedding and the response.
+    """
+
+    def __init__(self, maxsize, threshold, ttl, path=None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._version = None
+        self._vectors = None
+        self._entries = OrderedDict()
+        self._free = list(range(maxsize - 1, -1, -1))
+        self._logged = 0
+        self._lock = threading.Lock()
+        if path and maxsize > 0 and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, vector, version, variant=None):
+        """Return a copy of the cached response for a similar query, or None."""
+        vector = np.asarray(vector, dtype='float32').ravel()
+        with self._lock:
+            self._sync_version(version)
+            self._expire(time.time())
+            if self._entries:
+                slots = np.fromiter(self._entries.keys(), dtype='int64', count=len(self._entries))
+                similarities = (self._vectors @ vector)[slots]
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    slot = int(slots[i])
+                    entry = self._entries[slot]
+                    if entry.variant == variant:
+                        self._entries.move_to_end(slot)
+                        self.hits += 1
+                        return copy.deepcopy(entry.response)
+            self.misses += 1
+            return None
+
+    def put(self, vector, version, response, variant=None):
+        """Store a response for a query vector under an index version."""
+        if self.maxsize <= 0:
+            return
+        vector = np.asarray(vector, dtype='float32').ravel()
+        with self._lock:
+            self._sync_version(version)
+            entry = _Entry(version, variant, time.time(), copy.deepcopy(response))
+            self._insert(vector, entry)
+            if self.path:
+                self._append(vector, entry)
+
+    def clear(self):
+        """Drop all entries (including the on-disk ones)."""
+        with self._lock:
+            self._drop(list(self._entries))
+            self._rewrite()
+
+    def stats(self):
+        """Get hit/miss statistics and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+            "index_version": self._version,
+        }
+
+    def _insert(self, vector, entry):
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, len(vector)), dtype='float32')
+        if not self._free:
+            # Evict the least recently used entry
+            slot, _ = self._entries.popitem(last=False)
+            self._free.append(slot)
+            self.evictions += 1
+        slot = self._free.pop()
+        self._vectors[slot] = vector
+        self._entries[slot] = entry
+
+    def _drop(self, slots):
+        for slot in slots:
+            del self._entries[slot]
+            self._vectors[slot] = 0
+            self._free.append(slot)
+
+    def _sync_version(self, version):
+        """Drop entries of other index versions once a new version is in use."""
+        if version == self._version:
+            return
+        self._version = version
+        stale = [slot for slot, entry in self._entries.items() if entry.version != version]
+        if stale:
+            self._drop(stale)
+            self.invalidations += len(stale)
+            self._rewrite()
+
+    def _expire(self, now):
+        expired = [slot for slot, entry in self._entries.items() if now - entry.created_at > self.ttl]
+        if expired:
+            self._drop(expired)
+            self.expirations += len(expired)
+
+    def _record(self, vector, entry):
+        return {
+            "version": entry.version,
+            "variant": entry.variant,
+            "created_at": entry.created_at,
+            "vector": base64.b64encode(vector.astype('float32').tobytes()).decode("ascii"),
+            "response": entry.response,
+        }
+
+    def _append(self, vector, entry):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(self._record(vector, entry)) + "\n")
+        self._logged += 1
+        # The log also holds evicted entries; compact it once it's mostly stale
+        if self._logged > 2 * max(self.maxsize, len(self._entries)):
+            self._rewrite()
+
+    def _rewrite(self):
+        """Atomically replace the on-disk log with the current entries."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            for slot, entry in self._entries.items():
+                f.write(json.dumps(self._record(self._vectors[slot], entry)) + "\n")
+        os.replace(tmp_path, self.path)
+        self._logged = len(self._entries)
+
+    def _load(self):
+        """Replay the on-disk log, skipping expired and unreadable entries."""
+        now = time.time()
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    vector = np.frombuffer(base64.b64decode(record["vector"]), dtype='float32')
+                except (ValueError, KeyError):
+                    continue
+                if now - record["created_at"] > self.ttl:
+                    continue
+                if self._vectors is not None and len(vector) != self._vectors.shape[1]:
+                    continue
+                entry = _Entry(record["version"], record["variant"], record["created_at"], record["response"])
+                self._insert(vector, entry)
+        # Replaying more entries than fit isn't an eviction worth reporting
+        self.evictions = 0
+        self._rewrite()
+        logger.info("Loaded cached answers", answers=len(self._entries), path=self.path)
@@ -0,0 +1,226 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from app.utils.log import get_logger
+
+# Like warmup, keep this module free of heavy imports: the index services
+# are imported by the build thread.
+
+logger = get_logger(__name__)
+
+# Finished jobs kept for /indices/jobs
+MAX_FINISHED_JOBS = 20
+# Once the build reaches this step it publishes its indices and can no longer be cancelled
+FINAL_PHASE = "saving_snapshot"
+
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_running = None
+
+class BuildCancelled(Exception):
+    """Raised inside a build when its job is cancelled."""
+
+class BuildJob:
+    """A full index build running in a background thread.
+
+    The build reports its steps through progress() and the chunks,
+    documents and input bytes indexed so far through on_batch(). Both are
+    where a requested cancellation takes effect: between ingest batches
+    (so the current batch finishes first) or build steps. A cancelled or
+    failed build publishes nothing, and the current indices stay in place.
+    Once the build starts saving its snapshot it can't be cancelled, and
+    cancel() refuses.
+
+    Progress is the share of the corpus files read, so it needs no extra
+    pass over them; example data (used when a file is missing) isn't
+    counted.
+    """
+
+    def __init__(self, force):
+        self.id = uuid.uuid4().hex
+        self.force = force
+        self.state = "running"
+        self.phase = "starting"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        # Per-corpus chunks and documents indexed so far, and bytes of the corpus file read and in total (None for example data)
+        self.chunks_embedded = {}
+        self.documents_indexed = {}
+        self.bytes_read = {}
+        self.input_bytes = {}
+        self._indexing_started_at = None
+        self._listeners = []
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def add_listener(self, progress):
+        """Also pass this job's remaining steps to `progress`."""
+        with self._lock:
+            self._listeners.append(progress)
+
+    def progress(self, step):
+        """Record the build's next step; raises BuildCancelled if cancelled."""
+        with self._lock:
+            if self._cancel.is_set():
+                raise BuildCancelled("Build cancelled")
+            self.phase = step
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(step)
+
+    def set_input_bytes(self, sizes):
+        """Set each corpus's file size (None for example data) and start timing the indexing."""
+        with self._lock:
+            self.input_bytes = dict(sizes)
+            self.bytes_read = {corpus: 0 for corpus in sizes}
+            self.documents_indexed = {corpus: 0 for corpus in sizes}
+            self.chunks_embedded = {corpus: 0 for corpus in sizes}
+            self._indexing_started_at = time.time()
+
+    def on_batch(self, corpus, chunks, documents, bytes_read):
+        """Record how much of `corpus` is indexed; raises BuildCancelled if cancelled."""
+        with self._lock:
+            self.chunks_embedded[corpus] = chunks
+            self.documents_indexed[corpus] = documents
+            if bytes_read is not None:
+                self.bytes_read[corpus] = bytes_read
+        if self._cancel.is_set():
+            raise BuildCancelled("Build cancelled")
+
+    def cancel(self):
+        """Request cancellation. Returns False if the job finished or is already saving its snapshot."""
+        with self._lock:
+            if self._done.is_set() or self.phase == FINAL_PHASE:
+                return False
+            self._cancel.set()
+        logger.info("Cancelling index build", job=self.id)
+        return True
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def finish(self, state, result=None, error=None):
+        with self._lock:
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish and return the build status (with "error" if it didn't succeed)."""
+        self._done.wait(timeout)
+        if self.state == "succeeded":
+            return self.result
+        return {"error": self.error or f"Build {self.state}"}
+
+    def fraction_read(self):
+        """Share of the corpus files read so far (None if no corpus is read from a file)."""
+        sizes = {corpus: size for corpus, size in self.input_bytes.items() if size}
+        if not sizes:
+            return None
+        if self.state == "succeeded":
+            # Trailing whitespace and the end of a JSON array aren't reported as read
+            return 1.0
+        read = sum(min(self.bytes_read.get(corpus, 0), size) for corpus, size in sizes.items())
+        return read / sum(sizes.values())
+
+    def eta_seconds(self):
+        """Estimated seconds until the corpus files are fully indexed, from the rate so far (None if unknown)."""
+        fraction = self.fraction_read()
+        if self.state != "running" or not fraction:
+            return None
+        elapsed = time.time() - self._indexing_started_at
+        return round(elapsed * (1 - fraction) / fraction, 1)
+
+    def to_dict(self):
+        with self._lock:
+            fraction = self.fraction_read()
+            return {
+                "id": self.id,
+                "state": self.state,
+                "phase": self.phase,
+                "force": self.force,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 3),
+                "chunks_embedded": sum(self.chunks_embedded.values()),
+                "documents_indexed": sum(self.documents_indexed.values()),
+                "progress": round(fraction, 4) if fraction is not None else None,
+                "eta_seconds": self.eta_seconds(),
+                "corpora": {
+                    corpus: {
+                        "chunks_embedded": self.chunks_embedded.get(corpus, 0),
+                        "documents_indexed": self.documents_indexed.get(corpus, 0),
+                        "bytes_read": self.bytes_read.get(corpus, 0),
+                        "input_bytes": self.input_bytes.get(corpus),
+                    }
+                    for corpus in self.input_bytes
+                },
+                "cancel_requested": self._cancel.is_set(),
+                "error": self.error,
+                "result": self.result,
+            }
+
+def _run(job):
+    """Measure the corpus files to index, then build and publish the indices."""
+    global _running
+    try:
+        from app.services import faiss_setup
+
+        job.set_input_bytes({corpus: faiss_setup.corpus_input_bytes(corpus) for corpus in faiss_setup.CORPORA})
+        status = faiss_setup.build_indices(progress=job.progress, on_batch=job.on_batch)
+        if "error" not in status:
+            job.finish("succeeded", result=status)
+        elif job.cancel_requested:
+            job.finish("cancelled", error="Build cancelled")
+        else:
+            job.finish("failed", error=status["error"])
+    except Exception as e:
+        logger.exception("Index build job failed", job=job.id, error=str(e))
+        job.finish("failed", error=str(e))
+    finally:
+        with _lock:
+            if _running is job:
+                _running = None
+            finished = [job_id for job_id, other in _jobs.items() if other.finished_at is not None]
+            for job_id in finished[:-MAX_FINISHED_JOBS]:
+                del _jobs[job_id]
+    logger.info("Index build job finished", job=job.id, state=job.state, seconds=round(job.finished_at - job.created_at, 3))
+
+def start_build(force=True, progress=None):
+    """Start a background build, or join the one already running (single-flight).
+
+    Returns (job, started): `started` is False when an existing build was
+    joined. `progress`, if given, is called with each remaining build step.
+    """
+    global _running
+    with _lock:
+        job, started = _running, False
+        if job is None:
+            job, started = BuildJob(force), True
+            _jobs[job.id] = job
+            _running = job
+        if progress is not None:
+            job.add_listener(progress)
+    if started:
+        logger.info("Starting index build job", job=job.id, force=force)
+        threading.Thread(target=_run, args=(job,), name=f"index-build-{job.id[:8]}", daemon=True).start()
+    else:
+        logger.info("Joining running index build job", job=job.id)
+    return job, started
+
+def get_job(job_id):
+    """Get a build job by ID, or None."""
+    with _lock:
+        return _jobs.get(job_id)
+
+def list_jobs():
+    """Get the known build jobs, newest first."""
+    with _lock:
+        return list(reversed(_jobs.values()))
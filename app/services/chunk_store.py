@@ -0,0 +1,170 @@
+import bisect
+import json
+import os
+import numpy as np
+
+# Aspect codes; 0 means the chunk has no aspect (plain document text)
+TRIAL_ASPECTS = ("title", "condition", "intervention", "eligibility", "full")
+ASPECTS = ("",) + TRIAL_ASPECTS
+ASPECT_CODES = {aspect: code for code, aspect in enumerate(ASPECTS)}
+
+# Document position of a deleted chunk
+DELETED = -1
+
+def _encode_texts(texts):
+    """Pack texts into (offsets, data): text i is data[offsets[i]:offsets[i + 1]] as UTF-8."""
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype='int64')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype='uint8')
+
+class ChunkStore:
+    """Columnar chunk metadata for one corpus.
+
+    Row i describes the chunk with FAISS ID i: doc_ids[i] is the position
+    of its document in the corpus data (DELETED once removed), chunk_ids[i]
+    its number within the document and aspects[i] its ASPECTS code. Chunk
+    texts are stored as UTF-8 in byte buffers delimited by offset arrays.
+    Loaded stores are memory-mapped. Never modified once built; updates
+    return a new store.
+    """
+
+    __slots__ = ("source", "doc_key", "doc_ids", "chunk_ids", "aspects", "_segment_starts", "_segments")
+
+    def __init__(self, source, doc_key, doc_ids, chunk_ids, aspects, segments):
+        self.source = source
+        self.doc_key = doc_key
+        self.doc_ids = doc_ids
+        self.chunk_ids = chunk_ids
+        self.aspects = aspects
+        # Text segments as (first row, offsets, data); updates append a segment
+        self._segments = tuple(segments)
+        self._segment_starts = [start for start, _, _ in self._segments]
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def live_count(self):
+        """Number of chunks that are not deleted."""
+        return int(np.count_nonzero(self.doc_ids != DELETED))
+
+    def text(self, row):
+        """Get the text of the chunk at a row."""
+        start, offsets, data = self._segments[bisect.bisect_right(self._segment_starts, row) - 1]
+        i = row - start
+        return bytes(data[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def chunk(self, row):
+        """Get one chunk as a dict (as produced by the chunking functions), or None if deleted."""
+        doc_id = int(self.doc_ids[row])
+        if doc_id == DELETED:
+            return None
+        chunk = {"text": self.text(row), self.doc_key: doc_id, "chunk_id": int(self.chunk_ids[row]), "source": self.source}
+        if self.aspects[row]:
+            chunk["aspect"] = ASPECTS[self.aspects[row]]
+        return chunk
+
+    def doc_ids_for(self, rows):
+        """Map FAISS result IDs to document positions, with DELETED for padding (-1) and deleted chunks."""
+        rows = np.asarray(rows, dtype='int64')
+        valid = (rows >= 0) & (rows < len(self.doc_ids))
+        doc_ids = np.full(rows.shape, DELETED, dtype='int64')
+        doc_ids[valid] = self.doc_ids[rows[valid]]
+        return doc_ids
+
+    def rows_of_docs(self, doc_positions):
+        """Get the rows of all live chunks belonging to the given document positions."""
+        doc_positions = np.asarray(list(doc_positions), dtype='int64')
+        if len(doc_positions) == 0:
+            return np.zeros(0, dtype='int64')
+        return np.flatnonzero(np.isin(self.doc_ids, doc_positions)).astype('int64')
+
+    def updated(self, deleted_rows=(), new_chunks=()):
+        """Return a copy with some rows marked deleted and new chunks appended.
+
+        Existing text buffers are shared with the new store rather than copied.
+        """
+        doc_ids = np.array(self.doc_ids, dtype='int32')
+        doc_ids[np.asarray(deleted_rows, dtype='int64')] = DELETED
+        chunk_ids, aspects, segments = self.chunk_ids, self.aspects, list(self._segments)
+
+        if new_chunks:
+            builder = ChunkStoreBuilder(self.source, self.doc_key)
+            builder.add(new_chunks)
+            added = builder.build()
+            doc_ids = np.concatenate([doc_ids, added.doc_ids])
+            chunk_ids = np.concatenate([chunk_ids, added.chunk_ids])
+            aspects = np.concatenate([aspects, added.aspects])
+            segments.extend((start + len(self), offsets, data) for start, offsets, data in added._segments)
+
+        return ChunkStore(self.source, self.doc_key, doc_ids, chunk_ids, aspects, segments)
+
+    def save(self, directory):
+        """Write the store to a directory, merging text segments into one buffer."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "doc_ids.npy"), np.asarray(self.doc_ids, dtype='int32'))
+        np.save(os.path.join(directory, "chunk_ids.npy"), np.asarray(self.chunk_ids, dtype='int32'))
+        np.save(os.path.join(directory, "aspects.npy"), np.asarray(self.aspects, dtype='uint8'))
+
+        offsets = [np.zeros(1, dtype='int64')]
+        base = 0
+        with open(os.path.join(directory, "text.bin"), "wb") as f:
+            for _, segment_offsets, data in self._segments:
+                f.write(memoryview(np.ascontiguousarray(data)))
+                offsets.append(np.asarray(segment_offsets[1:], dtype='int64') + base)
+                base += int(segment_offsets[-1])
+        np.save(os.path.join(directory, "text_offsets.npy"), np.concatenate(offsets))
+
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"source": self.source, "doc_key": self.doc_key}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a store written by save(), memory-mapping its arrays."""
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+            for name in ("doc_ids", "chunk_ids", "aspects", "text_offsets")
+        }
+        text_path = os.path.join(directory, "text.bin")
+        if mmap and os.path.getsize(text_path) > 0:
+            data = np.memmap(text_path, dtype='uint8', mode='r')
+        else:
+            data = np.fromfile(text_path, dtype='uint8')
+        return cls(meta["source"], meta["doc_key"], arrays["doc_ids"], arrays["chunk_ids"], arrays["aspects"],
+                   [(0, arrays["text_offsets"], data)])
+
+class ChunkStoreBuilder:
+    """Accumulates chunk dicts batch by batch into a ChunkStore."""
+
+    def __init__(self, source, doc_key):
+        self.source = source
+        self.doc_key = doc_key
+        self.count = 0
+        self._doc_ids = []
+        self._chunk_ids = []
+        self._aspects = []
+        self._segments = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, chunks):
+        """Append a batch of chunk dicts; their rows follow the ones added before."""
+        if not chunks:
+            return
+        self._doc_ids.append(np.fromiter((chunk[self.doc_key] for chunk in chunks), dtype='int32', count=len(chunks)))
+        self._chunk_ids.append(np.fromiter((chunk["chunk_id"] for chunk in chunks), dtype='int32', count=len(chunks)))
+        self._aspects.append(np.fromiter((ASPECT_CODES[chunk.get("aspect", "")] for chunk in chunks), dtype='uint8', count=len(chunks)))
+        offsets, data = _encode_texts(chunk["text"] for chunk in chunks)
+        self._segments.append((self.count, offsets, data))
+        self.count += len(chunks)
+
+    def build(self):
+        """Return the finished ChunkStore."""
+        def column(parts, dtype):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        segments = self._segments or [(0, np.zeros(1, dtype='int64'), np.zeros(0, dtype='uint8'))]
+        return ChunkStore(self.source, self.doc_key, column(self._doc_ids, 'int32'),
+                          column(self._chunk_ids, 'int32'), column(self._aspects, 'uint8'), segments)
@@ -0,0 +1,177 @@
+import asyncio
+import math
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+from app.services.openai_clients import get_async_client
+from app.utils.config import settings
+from app.utils.log import get_logger
+from app.utils import metrics
+from app.utils.term_matcher import tokenize
+
+logger = get_logger(__name__)
+
+EMBEDDING_API_CALLS = metrics.Counter("medflow_embedding_api_calls", "Requests to the OpenAI embeddings API", labels=("model",))
+EMBEDDING_TOKENS = metrics.Counter("medflow_embedding_tokens", "Tokens billed by the OpenAI embeddings API", labels=("model",))
+
+EMBEDDERS = ("openai", "hashing", "sentence_transformers")
+
+# Output dimensions of known OpenAI models, checked against loaded snapshots
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+class Embedder:
+    """Turns texts into embedding vectors.
+
+    `name` identifies the model and is recorded in snapshots and cache keys,
+    so vectors from different embedders are never mixed. `dimension` is the
+    vector size, or None if only known after the first call. `remote`
+    embedders call an external service: their vectors are worth caching on
+    disk and their batches worth sending concurrently.
+    """
+
+    name = None
+    dimension = None
+    remote = False
+
+    def embed_batch(self, texts):
+        """Embed a list of texts, returning a float32 (n, d) matrix in input order."""
+        raise NotImplementedError
+
+    async def aembed_batch(self, texts):
+        """Async variant of embed_batch; runs it in a worker thread by default."""
+        return await asyncio.to_thread(self.embed_batch, texts)
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API.
+
+    `dimensions` asks models that support it (text-embedding-3-*) for
+    shortened embeddings; other models reject the parameter, so it is
+    checked here rather than failing every embedding call.
+    """
+
+    remote = True
+
+    def __init__(self, model, dimensions=0):
+        if dimensions:
+            if not model.startswith("text-embedding-3-"):
+                raise ValueError(f"OPENAI_EMBEDDING_DIMENSIONS is only supported by text-embedding-3-* models, not {model}")
+            native = OPENAI_DIMENSIONS.get(model)
+            if native is None:
+                raise ValueError(f"Unknown native dimension of {model}; add it to OPENAI_DIMENSIONS to shorten its embeddings")
+            if not 0 < dimensions <= native:
+                raise ValueError(f"OPENAI_EMBEDDING_DIMENSIONS must be between 1 and {native} for {model}, got {dimensions}")
+        self.model = model
+        self.dimensions = dimensions
+        self.name = f"{model}-{dimensions}" if dimensions else model
+        self.dimension = dimensions or OPENAI_DIMENSIONS.get(model)
+        self._options = {"dimensions": dimensions} if dimensions else {}
+
+    def embed_batch(self, texts):
+        # openai is imported on first use to keep application startup fast
+        import openai
+        openai.api_key = settings.OPENAI_KEY
+        response = openai.embeddings.create(
+            input=texts,
+            model=self.model,
+            **self._options
+        )
+        return self._matrix(response)
+
+    async def aembed_batch(self, texts):
+        response = await get_async_client().embeddings.create(
+            input=texts,
+            model=self.model,
+            **self._options
+        )
+        return self._matrix(response)
+
+    def _matrix(self, response):
+        EMBEDDING_API_CALLS.inc(model=self.model)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            EMBEDDING_TOKENS.inc(usage.total_tokens, model=self.model)
+        # Items carry their input position, so don't rely on response order
+        items = sorted(response.data, key=lambda item: item.index)
+        return np.asarray([item.embedding for item in items], dtype='float32')
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embedder based on feature hashing.
+
+    Each lowercase word and word bigram is hashed (CRC32, so vectors are the
+    same in every process) to one of `dimension` buckets with a hashed
+    sign, weighted by 1 + log(count). It needs no model or network and
+    embeds a query in well under a millisecond, but only captures word
+    overlap, not meaning, so retrieval is less accurate than with a neural
+    model.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed_batch(self, texts):
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            words = tokenize(text)
+            features = Counter(words)
+            features.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+            for feature, count in features.items():
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                vectors[row, hashed % self.dimension] += sign * (1.0 + math.log(count))
+        return vectors
+
+    async def aembed_batch(self, texts):
+        # Cheap enough to run on the event loop
+        return self.embed_batch(texts)
+
+class SentenceTransformerEmbedder(Embedder):
+    """Local CPU embeddings from a sentence-transformers model.
+
+    Needs the optional sentence-transformers package; the model is
+    downloaded once and cached by the library.
+    """
+
+    def __init__(self, model):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDER=sentence_transformers requires the sentence-transformers package") from e
+        self.model = SentenceTransformer(model, device="cpu")
+        self.name = f"sentence-transformers/{model}"
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        # encode() isn't safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def embed_batch(self, texts):
+        with self._lock:
+            vectors = self.model.encode(list(texts), convert_to_numpy=True)
+        return np.asarray(vectors, dtype='float32')
+
+def create_embedder(kind=None):
+    """Create the embedder selected by `kind` (default: the EMBEDDER setting)."""
+    kind = kind or settings.EMBEDDER
+    if kind == "openai":
+        return OpenAIEmbedder(settings.OPENAI_EMBEDDING_MODEL, settings.OPENAI_EMBEDDING_DIMENSIONS)
+    if kind == "hashing":
+        return HashingEmbedder(settings.HASHING_EMBEDDING_DIM)
+    if kind == "sentence_transformers":
+        return SentenceTransformerEmbedder(settings.LOCAL_EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedder {kind!r}, expected one of {', '.join(EMBEDDERS)}")
+
+def get_embedder():
+    """Get the configured embedder, creating it on first use."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = create_embedder()
+            logger.info("Using embedder", embedder=_embedder.name)
+        return _embedder
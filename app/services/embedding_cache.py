@@ -0,0 +1,138 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+KEY_SIZE = 16
+
+class EmbeddingCache:
+    """Append-only on-disk embedding store keyed by hash(model name + text).
+
+    Vectors live in a raw float32 file that is memory-mapped for reads, and
+    keys live in a parallel file of fixed-size digests (row i of the vector
+    file belongs to key i).
+
+    Several processes (uvicorn workers, a build and an update) can share a
+    cache directory: appends hold an exclusive flock on a lock file and
+    first pick up the rows other processes appended, so they always write
+    after the last row on disk.
+    """
+
+    def __init__(self, directory, model):
+        self.directory = directory
+        self.model = model
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, "lock")
+        self.dimension = None
+        self.rows = {}
+        # Rows of the files read so far (can exceed len(rows) if a key was stored twice)
+        self.count = 0
+        self.vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._refresh()
+
+    @contextlib.contextmanager
+    def _file_lock(self, mode=fcntl.LOCK_EX):
+        """Hold a flock on the cache directory's lock file, shared between processes."""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Read the rows added to the files since the last refresh, by any process, and map the vector file."""
+        if self.dimension is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model:
+                raise ValueError(f"Embedding cache at {self.directory} was built with model {meta.get('model')}, not {self.model}")
+            self.dimension = meta["dimension"]
+
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.count * KEY_SIZE)
+            raw_keys = f.read()
+        # A crash between the two appends can leave trailing vectors without keys
+        count = min(self.count + len(raw_keys) // KEY_SIZE, os.path.getsize(self.vectors_path) // (4 * self.dimension))
+        for i in range(self.count, count):
+            offset = (i - self.count) * KEY_SIZE
+            self.rows.setdefault(raw_keys[offset:offset + KEY_SIZE], i)
+        if count != self.count or self.vectors is None:
+            self.count = count
+            self._map(count)
+
+    def _map(self, count):
+        """Memory-map the first `count` rows of the vector file."""
+        if count == 0:
+            self.vectors = np.zeros((0, self.dimension), dtype='float32')
+        else:
+            self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(count, self.dimension))
+
+    def key(self, text):
+        """Return the cache key for a text under this cache's model."""
+        return hashlib.blake2b(f"{self.model}\0{text}".encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, keys):
+        """Return the row for each key, or None where the key is not cached."""
+        rows = self.rows
+        return [rows.get(key) for key in keys]
+
+    def add(self, keys, vectors):
+        """Append new (key, vector) pairs to the store."""
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if len(keys) != len(vectors):
+            raise ValueError("keys and vectors must have the same length")
+        if not keys:
+            return
+
+        with self._lock, self._file_lock():
+            # Other processes may have appended rows; write after the last one on disk
+            self._refresh()
+            if self.dimension is None:
+                self.dimension = int(vectors.shape[1])
+                open(self.keys_path, "wb").close()
+                open(self.vectors_path, "wb").close()
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model, "dimension": self.dimension}, f)
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dim vectors, got {vectors.shape[1]}")
+
+            # Another build may have stored some of these keys in the meantime
+            fresh = [i for i, key in enumerate(keys) if key not in self.rows]
+            if len(fresh) < len(keys):
+                keys = [keys[i] for i in fresh]
+                vectors = vectors[fresh]
+            if not keys:
+                return
+
+            start = self.count
+            # Write vectors before keys so a key never points past the vector file.
+            # Truncating only drops the unkeyed rows a crashed writer left behind
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * 4 * self.dimension)
+                f.write(vectors.tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.truncate(start * KEY_SIZE)
+                f.write(b"".join(keys))
+
+            for i, key in enumerate(keys):
+                self.rows[key] = start + i
+            self.count = start + len(keys)
+            self._map(self.count)
+
+    def get(self, rows):
+        """Return a float32 matrix holding the vectors at the given rows."""
+        return np.asarray(self.vectors[np.asarray(rows, dtype='int64')], dtype='float32')
@@ -1,26 +1,216 @@
+import asyncio
 import faiss
+import hashlib
+import itertools
 import os
 import json
+import threading
 import numpy as np
-import openai
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.services.build_jobs import BuildCancelled
+from app.services.chunk_store import ChunkStoreBuilder, DELETED, TRIAL_ASPECTS
+from app.services.embedders import get_embedder
+from app.services.embedding_cache import EmbeddingCache
+from app.services.grouped_search import aggregate_scores, grouped_search, reciprocal_rank_fusion
+from app.services.index_factory import IndexBuilder, apply_search_params, search_parameters
+from app.services.index_snapshot import CorpusIndex, IndexSnapshot, get_snapshot, publish_snapshot
+from app.services.index_store import save_snapshot, load_snapshot
+from app.services.ingestion import iter_json_records, batched
+from app.services.lexical_index import LexicalIndexBuilder
+from app.services.metadata_filter import FilterIndex, bitmap_contains
+from app.services.reranking_index import RerankingIndex
+from app.services.sharded_index import ShardedIndex
 from app.utils.config import settings
+from app.utils.log import get_logger
+from app.utils.lru_cache import LRUCache
+from app.utils.metrics import Counter, Histogram, Span
+from app.utils.rate_limiter import RateLimiter
 
-# Initialize global variables
-medical_faiss = None
-clinical_trial_faiss = None
-clinical_trials_data = []
-medical_data = []
-medical_chunks = []
-clinical_trial_chunks = []
-
-def get_embedding(text):
-    """Generate embedding using OpenAI API."""
-    openai.api_key = settings.OPENAI_KEY
-    response = openai.embeddings.create(
-        input=text,
-        model="text-embedding-ada-002"
-    )
-    return response.data[0].embedding
+logger = get_logger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+
+# Initialize global variables (the indices themselves live in index_snapshot)
+embedding_cache = None
+build_rate_limiter = None
+query_embedding_cache = LRUCache(settings.QUERY_EMBEDDING_CACHE_SIZE)
+# Serializes full builds and incremental updates, i.e. everything that publishes a snapshot
+index_update_lock = threading.RLock()
+
+EMBEDDING_SECONDS = Histogram("medflow_embedding_duration_seconds", "Embedder calls (kind: query or bulk)", labels=("kind",))
+EMBEDDED_TEXTS = Counter("medflow_embedded_texts", "Texts sent to the embedder", labels=("kind",))
+CACHE_REQUESTS = Counter("medflow_cache_requests", "Cache lookups by cache and result (hit or miss)", labels=("cache", "result"))
+INDEX_SEARCH_SECONDS = Histogram("medflow_index_search_duration_seconds", "Index searches by corpus and retriever (vector or lexical)",
+                                 labels=("corpus", "retriever"))
+INDEX_BUILD_SECONDS = Histogram("medflow_index_build_duration_seconds", "Corpus index builds and incremental updates",
+                                labels=("corpus", "operation"), buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200))
+
+def embed_texts(texts, kind):
+    """Embed texts with one timed embedder call (kind: "query" or "bulk")."""
+    EMBEDDED_TEXTS.inc(len(texts), kind=kind)
+    with Span(EMBEDDING_SECONDS, kind=kind):
+        return get_embedder().embed_batch(texts)
+
+async def aembed_texts(texts, kind):
+    """Async variant of embed_texts."""
+    EMBEDDED_TEXTS.inc(len(texts), kind=kind)
+    with Span(EMBEDDING_SECONDS, kind=kind):
+        return await get_embedder().aembed_batch(texts)
+
+def count_cache_lookup(cache, hit):
+    """Count a cache hit or miss for /metrics."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def embed_query(text):
+    """Get the normalized (1, d) query embedding, served from an LRU cache when possible."""
+    vector = query_embedding_cache.get(text)
+    count_cache_lookup("query_embedding", vector is not None)
+    if vector is None:
+        vector = normalize_vectors(embed_texts([text], "query"))
+        # Cached arrays are shared between requests
+        vector.setflags(write=False)
+        query_embedding_cache.put(text, vector)
+    return vector
+
+async def aembed_query(text):
+    """Async variant of embed_query."""
+    vector = query_embedding_cache.get(text)
+    count_cache_lookup("query_embedding", vector is not None)
+    if vector is None:
+        vector = normalize_vectors(await aembed_texts([text], "query"))
+        vector.setflags(write=False)
+        query_embedding_cache.put(text, vector)
+    return vector
+
+async def aembed_queries(texts):
+    """Embed a batch of queries with as few embedder calls as possible.
+    
+    Returns a normalized (n, d) matrix, one row per text. Cached queries
+    aren't re-embedded, and duplicates are embedded once.
+    """
+    vectors = [query_embedding_cache.get(text) for text in texts]
+    for vector in vectors:
+        count_cache_lookup("query_embedding", vector is not None)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    fetched = {}
+    semaphore = asyncio.Semaphore(settings.EMBEDDING_MAX_CONCURRENCY)
+    
+    async def embed(batch):
+        async with semaphore:
+            matrix = normalize_vectors(await aembed_texts(batch, "query"))
+        for text, row in zip(batch, matrix):
+            vector = row[None].copy()
+            vector.setflags(write=False)
+            query_embedding_cache.put(text, vector)
+            fetched[text] = vector
+    
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    await asyncio.gather(*(embed(missing[start:start + batch_size]) for start in range(0, len(missing), batch_size)))
+    return np.concatenate([vector if vector is not None else fetched[text] for text, vector in zip(texts, vectors)])
+
+def embed_batch(texts):
+    """Embed a batch of texts with a single embedder call, within the builds' share of the rate limit."""
+    limiter = get_build_rate_limiter()
+    if limiter is not None and get_embedder().remote:
+        waited = limiter.acquire(estimate_tokens(texts))
+        if waited > 1:
+            logger.info("Throttled bulk embedding", texts=len(texts), waited_seconds=round(waited, 2))
+    return embed_texts(texts, "bulk")
+
+def estimate_tokens(texts):
+    """Roughly estimate the tokens in texts (about 4 characters per token for English)."""
+    return sum(len(text) // 4 + 1 for text in texts)
+
+def get_build_rate_limiter():
+    """Get the limiter for bulk embedding, or None if EMBEDDING_TOKENS_PER_MINUTE is not set."""
+    global build_rate_limiter
+    if build_rate_limiter is None and settings.EMBEDDING_TOKENS_PER_MINUTE > 0:
+        share = min(max(settings.BUILD_EMBEDDING_RATE_SHARE, 0.01), 1.0)
+        build_rate_limiter = RateLimiter(settings.EMBEDDING_TOKENS_PER_MINUTE * share / 60)
+    return build_rate_limiter
+
+def get_embeddings(texts, batch_size=None, max_concurrency=None):
+    """Embed many texts using batched, concurrent embedder calls.
+    
+    Returns a float32 matrix with one row per input text, in input order.
+    At most `max_concurrency` requests are in flight at any time; local
+    embedders run one batch at a time.
+    """
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    max_concurrency = max_concurrency or (settings.EMBEDDING_MAX_CONCURRENCY if get_embedder().remote else 1)
+    
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+    
+    # Embed the first batch up front to learn the dimension, then
+    # preallocate the output matrix and fill it in place
+    first = embed_batch(texts[:batch_size])
+    embeddings = np.empty((len(texts), first.shape[1]), dtype='float32')
+    embeddings[:len(first)] = first
+    
+    starts = iter(range(batch_size, len(texts), batch_size))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = {}
+        
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                future = executor.submit(embed_batch, texts[start:start + batch_size])
+                pending[future] = start
+        
+        for _ in range(max_concurrency):
+            submit_next()
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = pending.pop(future)
+                batch = future.result()
+                embeddings[start:start + len(batch)] = batch
+                submit_next()
+    
+    return embeddings
+
+def get_embedding_cache():
+    """Get the current embedder's on-disk embedding cache, opening it on first use.
+
+    Each embedder gets its own subdirectory, so switching models (or
+    OPENAI_EMBEDDING_DIMENSIONS) starts a new cache instead of clashing
+    with the old one.
+    """
+    global embedding_cache
+    if embedding_cache is None:
+        cache_dir = settings.EMBEDDING_CACHE_DIR or os.path.join(DATA_DIR, 'embedding_cache')
+        model = get_embedder().name
+        embedding_cache = EmbeddingCache(os.path.join(cache_dir, model.replace('/', '_')), model)
+    return embedding_cache
+
+def embed_chunk_texts(texts):
+    """Embed chunk texts, only calling the API for texts not already cached.
+    
+    Identical texts are embedded once, and new vectors are added to the
+    cache so later rebuilds can reuse them. Local embedders are cheaper
+    to rerun than the cache, so their vectors aren't cached.
+    """
+    if not settings.EMBEDDING_CACHE_ENABLED or not get_embedder().remote:
+        return get_embeddings(texts)
+    
+    cache = get_embedding_cache()
+    keys = [cache.key(text) for text in texts]
+    
+    # Collect each distinct uncached text once
+    missing = {}
+    for key, text, row in zip(keys, texts, cache.lookup(keys)):
+        if row is None and key not in missing:
+            missing[key] = text
+    
+    CACHE_REQUESTS.inc(len(texts) - len(missing), cache="chunk_embedding", result="hit")
+    CACHE_REQUESTS.inc(len(missing), cache="chunk_embedding", result="miss")
+    if missing:
+        logger.info("Embedding new chunk texts", texts=len(missing), cached_or_repeated=len(texts) - len(missing))
+        cache.add(list(missing.keys()), get_embeddings(list(missing.values())))
+    
+    return cache.get(cache.lookup(keys))
 
 def get_example_medical_docs():
     """Get example medical documents."""
@@ -75,281 +265,610 @@ def create_chunks_from_text(text, chunk_size=200, overlap=50):
     
     return chunks
 
-def prepare_medical_chunks():
-    """Create chunks from medical data for better retrieval."""
-    global medical_chunks, medical_data
-    
-    medical_chunks = []
-    
-    for i, doc in enumerate(medical_data):
-        content = doc["content"]
-        # Split the content into chunks
-        doc_chunks = create_chunks_from_text(content)
-        
-        # Store each chunk with reference to the original document
-        for j, chunk in enumerate(doc_chunks):
-            medical_chunks.append({
-                "text": chunk,
-                "doc_id": i,
-                "chunk_id": j,
-                "source": "medical_data"
-            })
-    
-    return medical_chunks
-
-def prepare_clinical_trial_chunks():
-    """Create chunks from clinical trials for better retrieval."""
-    global clinical_trial_chunks, clinical_trials_data
-    
-    clinical_trial_chunks = []
-    
-    for i, trial in enumerate(clinical_trials_data):
-        # Create multiple chunks for different aspects of the trial
-        title_chunk = f"Title: {trial['title']}"
-        condition_chunk = f"Condition: {trial['condition']}"
-        intervention_chunk = f"Intervention: {trial['intervention']}"
-        eligibility_chunk = f"Eligibility: {trial['eligibility']}"
-        full_chunk = f"Title: {trial['title']}. Condition: {trial['condition']}. This trial studies {trial['intervention']} for patients with {trial['condition']}. Eligibility criteria: {trial['eligibility']}"
-        
-        # Add each chunk with reference to original trial
-        chunks = [
-            {"text": title_chunk, "aspect": "title"},
-            {"text": condition_chunk, "aspect": "condition"},
-            {"text": intervention_chunk, "aspect": "intervention"},
-            {"text": eligibility_chunk, "aspect": "eligibility"},
-            {"text": full_chunk, "aspect": "full"}
-        ]
-        
-        for j, chunk in enumerate(chunks):
-            clinical_trial_chunks.append({
-                "text": chunk["text"],
-                "aspect": chunk["aspect"],
-                "trial_id": i,
-                "chunk_id": j,
-                "source": "clinical_trial"
-            })
+def make_medical_chunks(doc, doc_id):
+    """Create the chunks for one medical document at position `doc_id`."""
+    # Split the content into chunks, each with a reference to the original document
+    return [
+        {
+            "text": chunk,
+            "doc_id": doc_id,
+            "chunk_id": j,
+            "source": "medical_data"
+        }
+        for j, chunk in enumerate(create_chunks_from_text(doc["content"]))
+    ]
+
+def make_clinical_trial_chunks(trial, trial_id):
+    """Create the chunks for one clinical trial at position `trial_id`."""
+    # Create multiple chunks for different aspects of the trial
+    title_chunk = f"Title: {trial['title']}"
+    condition_chunk = f"Condition: {trial['condition']}"
+    intervention_chunk = f"Intervention: {trial['intervention']}"
+    eligibility_chunk = f"Eligibility: {trial['eligibility']}"
+    full_chunk = f"Title: {trial['title']}. Condition: {trial['condition']}. This trial studies {trial['intervention']} for patients with {trial['condition']}. Eligibility criteria: {trial['eligibility']}"
+    
+    chunks = [
+        {"text": title_chunk, "aspect": "title"},
+        {"text": condition_chunk, "aspect": "condition"},
+        {"text": intervention_chunk, "aspect": "intervention"},
+        {"text": eligibility_chunk, "aspect": "eligibility"},
+        {"text": full_chunk, "aspect": "full"}
+    ]
     
-    return clinical_trial_chunks
+    # Add each chunk with reference to original trial
+    return [
+        {
+            "text": chunk["text"],
+            "aspect": chunk["aspect"],
+            "trial_id": trial_id,
+            "chunk_id": j,
+            "source": "clinical_trial"
+        }
+        for j, chunk in enumerate(chunks)
+    ]
+
+# Document fields searches can filter on (every corpus can also filter on the chunk "aspect")
+MEDICAL_FILTER_FIELDS = {
+    "condition": lambda doc: (doc.get("metadata") or {}).get("condition"),
+    "type": lambda doc: (doc.get("metadata") or {}).get("type"),
+}
+TRIAL_FILTER_FIELDS = {
+    "condition": lambda doc: doc.get("condition"),
+}
+
+CORPORA = {
+    "medical": {"id_prefix": "doc", "doc_key": "doc_id", "source": "medical_data", "make_chunks": make_medical_chunks,
+                "filter_fields": MEDICAL_FILTER_FIELDS},
+    "clinical_trials": {"id_prefix": "trial", "doc_key": "trial_id", "source": "clinical_trial", "make_chunks": make_clinical_trial_chunks,
+                        "filter_fields": TRIAL_FILTER_FIELDS}
+}
+
+def document_id(doc, prefix):
+    """Get a document's stable ID: its own "id" (or "nct_id"), else a hash of its content."""
+    for field in ("id", "nct_id"):
+        if doc.get(field):
+            return str(doc[field])
+    content = json.dumps({key: value for key, value in doc.items() if key != "score"}, sort_keys=True)
+    return f"{prefix}-{hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]}"
+
+def assign_document_ids(docs, prefix):
+    """Give every document a unique, stable "id" field, yielding the documents as they come."""
+    seen = set()
+    for doc in docs:
+        doc_id = base_id = document_id(doc, prefix)
+        suffix = 2
+        # Identical documents get distinct IDs
+        while doc_id in seen:
+            doc_id = f"{base_id}-{suffix}"
+            suffix += 1
+        seen.add(doc_id)
+        doc["id"] = doc_id
+        yield doc
+
+def count_documents(data):
+    """Count documents, skipping positions left empty by deletions."""
+    return sum(1 for doc in data if doc is not None)
 
 def normalize_vectors(vectors):
-    """Normalize vectors to prepare for cosine similarity search."""
+    """Normalize vectors in place to prepare for cosine similarity search."""
     norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-    return vectors / norms
+    # Leave all-zero vectors (e.g. texts without words for the hashing embedder) as they are
+    norms[norms == 0] = 1
+    vectors /= norms
+    return vectors
 
-def build_medical_faiss():
-    """Build FAISS index for medical knowledge."""
-    global medical_data, medical_chunks
-    
-    # Path to your medical data file - adjust as needed
-    data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'medical_knowledge.json')
-    
+def find_data_file(name, configured_path=""):
+    """Get the path of a corpus file: the configured one, else data/<name>.jsonl or data/<name>.json."""
+    if configured_path:
+        return configured_path
+    jsonl_path = os.path.join(DATA_DIR, f'{name}.jsonl')
+    if os.path.exists(jsonl_path):
+        return jsonl_path
+    return os.path.join(DATA_DIR, f'{name}.json')
+
+def build_corpus_index(corpus, docs, on_batch=None, position=None):
+    """Build a corpus' index from an iterable of documents in one streaming pass.
+    
+    Documents are given IDs, chunked and embedded in batches of
+    INGEST_BATCH_SIZE chunks, and each batch's vectors are added to the
+    index before the next batch is read. Neither the raw file nor the full
+    embedding matrix is ever held in memory; only the documents, the
+    compact chunk store and the BM25 index are kept, since searches need
+    them. `on_batch`, if given, is called after every batch with the corpus,
+    the numbers of chunks and documents indexed so far and the bytes of
+    input read so far (from `position`, a callable, or None if the input
+    isn't a file); an exception it raises aborts the build.
+    """
+    with Span(INDEX_BUILD_SECONDS, corpus=corpus, operation="build"):
+        return _build_corpus_index(corpus, docs, on_batch or (lambda corpus, chunks, documents, bytes_read: None),
+                                   position or (lambda: None))
+
+def _build_corpus_index(corpus, docs, on_batch, position):
+    spec = CORPORA[corpus]
+    data = []
+    chunks = ChunkStoreBuilder(spec["source"], spec["doc_key"])
+    lexical = LexicalIndexBuilder()
+    # Full-precision vectors for re-ranking are spooled next to the snapshots
+    builder = IndexBuilder(vector_dir=get_index_dir())
+    
+    def iter_chunks():
+        for doc in assign_document_ids(docs, spec["id_prefix"]):
+            data.append(doc)
+            yield from spec["make_chunks"](doc, len(data) - 1)
+    
+    for batch in batched(iter_chunks(), settings.INGEST_BATCH_SIZE):
+        # Normalize for cosine similarity (inner product on normalized vectors), reusing cached vectors
+        embeddings = normalize_vectors(embed_chunk_texts([chunk["text"] for chunk in batch]))
+        builder.add(embeddings, np.arange(len(chunks), len(chunks) + len(batch)))
+        chunks.add(batch)
+        lexical.add([chunk["text"] for chunk in batch])
+        logger.info("Indexed chunks", corpus=corpus, chunks=len(chunks), documents=len(data))
+        on_batch(corpus, len(chunks), len(data), position())
+    
+    index, report = builder.finish()
+    return CorpusIndex(index, chunks.build(), data, report, lexical.build())
+
+def build_corpus_from_file(corpus, data_path, example_docs, label, on_batch=None):
+    """Stream a corpus from its JSON or JSONL file, falling back to example data.
+    
+    Only a file that can't be opened or doesn't start with a valid record
+    falls back to the examples. Errors later in the build (a malformed
+    record deep in the file, embedding or index failures) propagate, so
+    the build fails and the current indices stay in place.
+    """
     # Check if data file exists, otherwise use example data
     if os.path.exists(data_path):
+        # Progress through the file, reported with each batch
+        bytes_read = 0
+        def on_progress(position):
+            nonlocal bytes_read
+            bytes_read = position
+        
+        records = iter_json_records(data_path, on_progress=on_progress)
         try:
-            with open(data_path, 'r') as f:
-                medical_data = json.load(f)
-            print(f"Loaded {len(medical_data)} medical documents")
-        except Exception as e:
-            print(f"Error loading medical data: {e}")
-            # Fallback to example data
-            medical_data = get_example_medical_docs()
-            print("Using example medical data instead")
+            first = next(records, None)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading {label}, using example {label} instead", corpus=corpus, path=data_path, error=str(e))
+        else:
+            docs = itertools.chain([first] if first is not None else [], records)
+            corpus_index = build_corpus_index(corpus, docs, on_batch, position=lambda: bytes_read)
+            logger.info(f"Loaded {label}", corpus=corpus, documents=len(corpus_index.data), path=data_path)
+            return corpus_index
     else:
-        # Use example data if file doesn't exist
-        print(f"Warning: Medical data file not found at {data_path}")
-        medical_data = get_example_medical_docs()
-        print("Using example medical data")
-    
-    # Create chunks from medical data
-    medical_chunks = prepare_medical_chunks()
-    print(f"Created {len(medical_chunks)} chunks from medical data")
-    
-    # Generate embeddings for chunks
-    embeddings = []
-    for chunk in medical_chunks:
-        embedding = get_embedding(chunk["text"])
-        embeddings.append(embedding)
-    
-    # Normalize vectors for cosine similarity
-    embeddings_np = np.array(embeddings).astype('float32')
-    normalized_embeddings = normalize_vectors(embeddings_np)
-    
-    # Create FAISS index
-    dimension = len(embeddings[0])
-    # Use IndexFlatIP for cosine similarity (inner product on normalized vectors)
-    index = faiss.IndexFlatIP(dimension)
-    index.add(normalized_embeddings)
-    
-    print(f"Built medical FAISS index with {len(medical_chunks)} chunks")
-    return index
-
-def build_clinical_trial_faiss():
+        logger.warning(f"{label.capitalize()} file not found, using example {label}", corpus=corpus, path=data_path)
+    return build_corpus_index(corpus, example_docs(), on_batch)
+
+def corpus_input_bytes(corpus):
+    """Get the size of the file a build of a corpus will read, for progress reports (None for example data)."""
+    name, configured_path = {
+        "medical": ('medical_knowledge', settings.MEDICAL_DATA_PATH),
+        "clinical_trials": ('clinical_trials', settings.CLINICAL_TRIALS_DATA_PATH),
+    }[corpus]
+    try:
+        return os.path.getsize(find_data_file(name, configured_path))
+    except OSError:
+        return None
+
+def build_medical_faiss(on_batch=None):
+    """Build FAISS index for medical knowledge."""
+    data_path = find_data_file('medical_knowledge', settings.MEDICAL_DATA_PATH)
+    medical = build_corpus_from_file("medical", data_path, get_example_medical_docs, "medical documents", on_batch)
+    report = medical.report
+    logger.info("Built medical FAISS index", chunks=len(medical.chunks), recall_k=report['recall_k'], recall=report['recall'])
+    return medical
+
+def build_clinical_trial_faiss(on_batch=None):
     """Build FAISS index for clinical trials."""
-    global clinical_trials_data, clinical_trial_chunks
-    
-    # Path to your clinical trials data file - adjust as needed
-    data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'clinical_trials.json')
-    
-    # Check if data file exists, otherwise use example data
-    if os.path.exists(data_path):
+    data_path = find_data_file('clinical_trials', settings.CLINICAL_TRIALS_DATA_PATH)
+    clinical_trials = build_corpus_from_file("clinical_trials", data_path, get_example_clinical_trials, "clinical trials", on_batch)
+    report = clinical_trials.report
+    logger.info("Built clinical trials FAISS index", chunks=len(clinical_trials.chunks), recall_k=report['recall_k'], recall=report['recall'])
+    return clinical_trials
+
+def build_indices(progress=None, on_batch=None):
+    """Build both FAISS indices and publish them as a new snapshot.
+    
+    `progress`, if given, is called with the name of each build step, and
+    `on_batch` as in build_corpus_index. Runs in the calling thread; use
+    build_jobs.start_build to build in the background without duplicate
+    concurrent builds.
+    """
+    progress = progress or (lambda step: None)
+    
+    # Hold the update lock so incremental updates never interleave with a rebuild
+    with index_update_lock:
         try:
-            with open(data_path, 'r') as f:
-                clinical_trials_data = json.load(f)
-            print(f"Loaded {len(clinical_trials_data)} clinical trials")
+            logger.info("Building medical FAISS index")
+            progress("building_medical_index")
+            medical = build_medical_faiss(on_batch)
+            
+            logger.info("Building clinical trials FAISS index")
+            progress("building_clinical_trials_index")
+            clinical_trials = build_clinical_trial_faiss(on_batch)
+            
+            # Persist the new indices so other processes and restarts can load them
+            progress("saving_snapshot")
+            version = None
+            try:
+                version = save_indices(medical, clinical_trials)
+            except Exception as e:
+                logger.warning("Failed to save index snapshot", error=str(e))
+            
+            # Swap in the new indices in one step; in-flight requests keep the old ones
+            snapshot = IndexSnapshot(medical, clinical_trials, version=version)
+            publish_snapshot(snapshot)
+            
+            status = {
+                "medical_index": "built successfully",
+                "clinical_trials_index": "built successfully",
+                "clinical_trials_count": count_documents(clinical_trials.data),
+                "index_reports": snapshot.reports
+            }
+            if version is not None:
+                status["snapshot_version"] = version
+            
+            return status
+        except BuildCancelled as e:
+            logger.info("Index build cancelled")
+            return {"error": str(e)}
         except Exception as e:
-            print(f"Error loading clinical trials data: {e}")
-            # Fallback to example data
-            clinical_trials_data = get_example_clinical_trials()
-            print("Using example clinical trials data instead")
-    else:
-        # Use example data if file doesn't exist
-        print(f"Warning: Clinical trials data file not found at {data_path}")
-        clinical_trials_data = get_example_clinical_trials()
-        print("Using example clinical trials data")
-    
-    # Create chunks from clinical trials
-    clinical_trial_chunks = prepare_clinical_trial_chunks()
-    print(f"Created {len(clinical_trial_chunks)} chunks from clinical trials")
-    
-    # Generate embeddings for chunks
-    embeddings = []
-    for chunk in clinical_trial_chunks:
-        embedding = get_embedding(chunk["text"])
-        embeddings.append(embedding)
-    
-    # Normalize vectors for cosine similarity
-    embeddings_np = np.array(embeddings).astype('float32')
-    normalized_embeddings = normalize_vectors(embeddings_np)
-    
-    # Create FAISS index
-    dimension = len(embeddings[0])
-    # Use IndexFlatIP for cosine similarity (inner product on normalized vectors)
-    index = faiss.IndexFlatIP(dimension)
-    index.add(normalized_embeddings)
-    
-    print(f"Built clinical trials FAISS index with {len(clinical_trial_chunks)} chunks")
-    return index
-
-def build_indices():
-    """Build both FAISS indices."""
-    global medical_faiss, clinical_trial_faiss
-    
+            logger.exception("Error building indices", error=str(e))
+            return {"error": str(e)}
+
+def get_index_dir():
+    """Get the directory holding on-disk index snapshots."""
+    return settings.INDEX_DIR or os.path.join(DATA_DIR, 'indices')
+
+def save_indices(medical, clinical_trials, changed=None, base_version=None):
+    """Save both corpora (index, chunks and source data) as a new on-disk snapshot.
+    
+    With `changed` and `base_version`, only the named corpus is written; the
+    other one reuses its files from snapshot `base_version`.
+    """
+    corpora = {
+        name: {"index": corpus.index, "chunks": corpus.chunks, "lexical": corpus.lexical, "data": corpus.data}
+        for name, corpus in (("medical", medical), ("clinical_trials", clinical_trials))
+    }
+    if changed is not None and base_version is not None:
+        corpora = {name: corpus if name == changed else None for name, corpus in corpora.items()}
+    manifest = {
+        "embedder": settings.EMBEDDER,
+        "embedding_model": get_embedder().name,
+        "dimension": medical.index.d,
+        "index_reports": {"medical": medical.report, "clinical_trials": clinical_trials.report}
+    }
+    version = save_snapshot(get_index_dir(), corpora, manifest, keep=settings.INDEX_SNAPSHOTS_KEPT, base_version=base_version)
+    logger.info("Saved index snapshot", version=version, directory=get_index_dir())
+    return version
+
+def load_indices():
+    """Load and publish indices from the current snapshot. Returns True if one was loaded."""
+    with index_update_lock:
+        # Query vectors must come from the embedder that built the snapshot
+        embedder = get_embedder()
+        expected = {"embedding_model": embedder.name}
+        if embedder.dimension is not None:
+            expected["dimension"] = embedder.dimension
+        snapshot = load_snapshot(get_index_dir(), expected=expected)
+        if snapshot is None:
+            return False
+        
+        manifest, corpora = snapshot
+        reports = manifest.get("index_reports", {})
+        medical, clinical_trials = (
+            CorpusIndex(apply_search_params(corpora[name]["index"]), corpora[name]["chunks"], corpora[name]["data"],
+                        reports.get(name), corpora[name]["lexical"])
+            for name in ("medical", "clinical_trials")
+        )
+        publish_snapshot(IndexSnapshot(medical, clinical_trials, version=manifest["version"]))
+    
+    logger.info("Loaded index snapshot", version=manifest['version'], medical_chunks=medical.chunks.live_count(),
+                clinical_trial_chunks=clinical_trials.chunks.live_count())
+    return True
+
+def load_or_build_indices(progress=None):
+    """Load indices from the current snapshot, building them if there is none."""
+    progress = progress or (lambda step: None)
     try:
-        print("Building medical FAISS index...")
-        medical_faiss = build_medical_faiss()
+        progress("loading_snapshot")
+        if load_indices():
+            return get_indices_status()
+    except Exception as e:
+        logger.warning("Failed to load index snapshot", error=str(e))
+    
+    logger.info("No usable index snapshot found, building indices")
+    # Imported here because build jobs run their builds through this module
+    from app.services.build_jobs import start_build
+    # Join any build already started through /indices/build rather than building twice
+    job, _ = start_build(progress=progress)
+    return job.wait()
+
+def writable_copy(index):
+    """Copy an index into owned memory so it can be modified.
+    
+    Snapshot indices may be memory-mapped read-only, and FAISS aborts the
+    process if such an index is modified in place. Copying also keeps the
+    published index untouched while requests are searching it.
+    """
+    if isinstance(index, RerankingIndex):
+        # The full-precision vectors are never modified, only extended into a new store
+        return RerankingIndex(writable_copy(index.index), index.vectors, index.factor)
+    if isinstance(index, ShardedIndex):
+        return ShardedIndex([writable_copy(shard) for shard in index.shards])
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+def update_corpus(corpus, upserts=(), deletes=()):
+    """Upsert and delete documents of a corpus by stable ID, without a full rebuild.
+    
+    Only the chunks of the affected documents are embedded, added or removed.
+    Positions in the data list and chunk store never move (chunk rows are
+    the FAISS IDs), so deleted or replaced documents are left as None and
+    their chunks marked deleted until the next full build compacts them.
+    If an ID is upserted more than once, the last document wins. The result
+    is published as a new snapshot, in which only this corpus's files are
+    rewritten.
+    
+    Known cost: the corpus's FAISS index is copied in full before it is
+    modified (see writable_copy), and its index, chunk store, lexical index
+    and data are rewritten in full to the snapshot, so an update still
+    takes memory and disk proportional to the size of the updated corpus.
+    """
+    spec = CORPORA[corpus]
+    
+    with index_update_lock, Span(INDEX_BUILD_SECONDS, corpus=corpus, operation="update"):
+        current = get_snapshot()
+        if current is None:
+            raise RuntimeError("Indices are not built, use the /indices/build endpoint first")
         
-        print("Building clinical trials FAISS index...")
-        clinical_trial_faiss = build_clinical_trial_faiss()
+        # Work on copies of the published corpus
+        old = current.corpus(corpus)
+        index = writable_copy(old.index)
+        data = list(old.data)
+        slots = {doc["id"]: i for i, doc in enumerate(data) if doc is not None}
         
-        # Verify indices were built correctly
-        if medical_faiss is None or clinical_trial_faiss is None:
-            raise ValueError("Failed to build one or more indices")
+        # One document per ID, the last one given
+        unique_upserts = {}
+        for doc in upserts:
+            doc = dict(doc)
+            doc["id"] = document_id(doc, spec["id_prefix"])
+            unique_upserts[doc["id"]] = doc
+        upserts = list(unique_upserts.values())
+        deleted = [doc_id for doc_id in dict.fromkeys(deletes) if doc_id in slots]
+        not_found = [doc_id for doc_id in dict.fromkeys(deletes) if doc_id not in slots]
         
-        status = {
-            "medical_index": "built successfully" if medical_faiss else "failed",
-            "clinical_trials_index": "built successfully" if clinical_trial_faiss else "failed",
-            "clinical_trials_count": len(clinical_trials_data)
-        }
+        # Drop the chunks of deleted documents and of documents being replaced
+        stale_slots = {slots[doc_id] for doc_id in deleted}
+        stale_slots.update(slots[doc["id"]] for doc in upserts if doc["id"] in slots)
+        stale_chunk_ids = old.chunks.rows_of_docs(stale_slots)
+        if len(stale_chunk_ids):
+            try:
+                index.remove_ids(stale_chunk_ids)
+            except RuntimeError:
+                # e.g. HNSW: the vectors stay, but searches skip deleted chunks
+                logger.info("Index does not support removal; stale vectors will be skipped", corpus=corpus,
+                            stale_vectors=len(stale_chunk_ids))
+        for doc_id in deleted:
+            data[slots.pop(doc_id)] = None
         
-        return status
-    except Exception as e:
-        print(f"Error building indices: {e}")
-        return {"error": str(e)}
+        # Store new and replaced documents and chunk them
+        new_chunks = []
+        for doc in upserts:
+            slot = slots.get(doc["id"])
+            if slot is None:
+                slot = len(data)
+                data.append(doc)
+                slots[doc["id"]] = slot
+            else:
+                data[slot] = doc
+            new_chunks.extend(spec["make_chunks"](doc, slot))
+        
+        if new_chunks:
+            embeddings = normalize_vectors(embed_chunk_texts([chunk["text"] for chunk in new_chunks]))
+            index.add_with_ids(embeddings, np.arange(len(old.chunks), len(old.chunks) + len(new_chunks), dtype='int64'))
+        chunks = old.chunks.updated(deleted_rows=stale_chunk_ids, new_chunks=new_chunks)
+        lexical = old.lexical.updated([chunk["text"] for chunk in new_chunks])
+        
+        logger.info("Updated corpus", corpus=corpus, upserted=len(upserts), deleted=len(deleted),
+                    chunks_added=len(new_chunks), chunks_removed=len(stale_chunk_ids))
+        
+        # The other corpus is shared unchanged with the current snapshot
+        updated = CorpusIndex(index, chunks, data, old.report, lexical)
+        medical = updated if corpus == "medical" else current.medical
+        clinical_trials = updated if corpus == "clinical_trials" else current.clinical_trials
+        
+        version = None
+        try:
+            version = save_indices(medical, clinical_trials, changed=corpus, base_version=current.version)
+        except Exception as e:
+            logger.warning("Failed to save index snapshot", error=str(e))
+        publish_snapshot(IndexSnapshot(medical, clinical_trials, version=version))
+        
+        return {
+            "upserted": [doc["id"] for doc in upserts],
+            "deleted": deleted,
+            "not_found": not_found,
+            "chunks_added": len(new_chunks),
+            "chunks_removed": int(len(stale_chunk_ids)),
+            "snapshot_version": version
+        }
 
 def get_indices_status():
     """Check if indices are built."""
-    global medical_faiss, clinical_trial_faiss
+    snapshot = get_snapshot()
     return {
-        "medical_index_built": medical_faiss is not None,
-        "clinical_trials_index_built": clinical_trial_faiss is not None,
-        "clinical_trials_count": len(clinical_trials_data)
+        "medical_index_built": snapshot is not None,
+        "clinical_trials_index_built": snapshot is not None,
+        "clinical_trials_count": count_documents(snapshot.clinical_trials.data) if snapshot else 0,
+        "snapshot_version": snapshot.version if snapshot else None,
+        # Per-corpus index type, memory use and recall, as measured at build time
+        "index_reports": snapshot.reports if snapshot else None
     }
 
-def search_medical_knowledge(query, k=4):
-    """Search medical knowledge index."""
-    global medical_faiss, medical_data, medical_chunks
-    
-    if medical_faiss is None or not medical_chunks:
-        return []
-    
-    # Generate embedding for query
-    query_embedding = get_embedding(query)
-    query_embedding_np = np.array([query_embedding]).astype('float32')
-    
-    # Normalize query vector for cosine similarity
-    normalized_query = normalize_vectors(query_embedding_np)
+def get_filter_index(corpus, corpus_index):
+    """Get a corpus' FilterIndex, building it on first use."""
+    # Concurrent first uses may both build it; either result is the same
+    if corpus_index.filters is None:
+        corpus_index.filters = FilterIndex(corpus_index.chunks, corpus_index.data, CORPORA[corpus]["filter_fields"])
+    return corpus_index.filters
+
+def filtered_search_params(corpus, corpus_index, filters):
+    """Get (params, bitmap, count) restricting searches of a corpus to the chunks matching `filters`.
+    
+    Returns (None, None, None) without filters. FAISS only visits the
+    matching IDs, so selective filters make searches cheaper rather than
+    dropping results afterwards. IVF indices probe more lists the more
+    selective the filter (see search_parameters).
+    """
+    if not filters:
+        return None, None, None
+    bitmap, count = get_filter_index(corpus, corpus_index).bitmap(filters)
+    # The selector takes the bitmap's length in bytes
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    params = search_parameters(corpus_index.index, selector, selectivity=count / max(len(corpus_index.chunks), 1))
+    # Keep the bitmap alive as long as the selector reading it
+    params.referenced_objects.append(bitmap)
+    return params, bitmap, count
+
+def lexical_search(corpus, corpus_index, queries, n, bitmap=None):
+    """Rank documents by BM25 for each query text, returning up to `n` document positions per query.
+    
+    With a filter `bitmap`, only chunks set in it are considered.
+    """
+    rankings = []
+    for query in queries:
+        with Span(INDEX_SEARCH_SECONDS, corpus=corpus, retriever="lexical"):
+            rows, scores = corpus_index.lexical.search(query)
+        if bitmap is not None:
+            matching = bitmap_contains(bitmap, rows)
+            rows, scores = rows[matching], scores[matching]
+        doc_ids, _ = aggregate_scores(corpus_index.chunks.doc_ids_for(rows), scores)
+        rankings.append(doc_ids[:n])
+    return rankings
+
+def hybrid_enabled(queries):
+    """Whether searches should fuse in lexical results for these query texts."""
+    return queries is not None and settings.HYBRID_SEARCH_ENABLED
+
+def search_medical_knowledge(query, k=4, query_vector=None, snapshot=None, filters=None):
+    """Search medical knowledge index.
+    
+    Pass the request's pinned `snapshot` so all its searches see the same
+    index version; defaults to the current one. `filters` restricts the
+    search to matching documents, e.g. {"condition": ["diabetes",
+    "hypertension"], "type": "chronic"}; values of a field are
+    alternatives, and all fields must match.
+    """
+    # Use the caller's precomputed query vector, or embed the query (normalized for cosine similarity)
+    normalized_query = query_vector if query_vector is not None else embed_query(query)
+    return search_medical_knowledge_batch(normalized_query, k, snapshot, queries=[query], filters=filters)[0]
+
+def search_medical_knowledge_batch(query_vectors, k=4, snapshot=None, queries=None, filters=None):
+    """Search medical knowledge for a batch of normalized query vectors with one FAISS call.
+    
+    With the query texts in `queries` (and HYBRID_SEARCH_ENABLED), the
+    vector results are fused with BM25 keyword results by reciprocal rank
+    fusion, and scores are fused scores in [0, 1] rather than cosine
+    similarities. `filters` applies to every query, as in
+    search_medical_knowledge. Returns one list of up to `k` unique
+    documents per query, best first.
+    """
+    snapshot = snapshot or get_snapshot()
+    if snapshot is None or len(snapshot.medical.chunks) == 0:
+        return [[] for _ in range(len(query_vectors))]
+    medical = snapshot.medical
+    medical_faiss, medical_chunks, medical_data = medical.index, medical.chunks, medical.data
+    params, bitmap, count = filtered_search_params("medical", medical, filters)
+    if count == 0:
+        return [[] for _ in range(len(query_vectors))]
+    hybrid = hybrid_enabled(queries)
+    depth = max(k, settings.HYBRID_CANDIDATES) if hybrid else k
     
     # Perform search
-    distances, indices = medical_faiss.search(normalized_query, k)
-    
-    # Get results
-    results = []
-    seen_doc_ids = set()
-    for i, idx in enumerate(indices[0]):
-        if idx < len(medical_chunks):
-            chunk = medical_chunks[idx]
-            doc_id = chunk["doc_id"]
-            
+    with Span(INDEX_SEARCH_SECONDS, corpus="medical", retriever="vector"):
+        distances, indices = medical_faiss.search(np.ascontiguousarray(query_vectors), depth, params=params)
+    
+    # Map result rows to documents; FAISS padding (-1) and deleted chunks map to DELETED
+    doc_ids = medical_chunks.doc_ids_for(indices)
+    lexical_rankings = lexical_search("medical", medical, queries, depth, bitmap) if hybrid else None
+    
+    batch_results = []
+    for i, (query_distances, query_doc_ids) in enumerate(zip(distances.tolist(), doc_ids.tolist())):
+        # Rank unique documents by their best chunk (higher is better for inner product/cosine)
+        ranked = []
+        seen_doc_ids = set()
+        for score, doc_id in zip(query_distances, query_doc_ids):
             # Avoid duplicate documents in results
-            if doc_id not in seen_doc_ids and doc_id < len(medical_data):
+            if doc_id != DELETED and doc_id not in seen_doc_ids:
                 seen_doc_ids.add(doc_id)
-                doc = medical_data[doc_id]
-                # Add score to help with ranking
-                doc["score"] = float(distances[0][i])
-                results.append(doc)
-    
-    # Sort by score (higher is better for inner product/cosine)
-    results.sort(key=lambda x: x["score"], reverse=True)
+                ranked.append((doc_id, score))
+        
+        if hybrid:
+            fused_ids, fused_scores = reciprocal_rank_fusion([[doc_id for doc_id, _ in ranked], lexical_rankings[i]])
+            ranked = list(zip(fused_ids[:k].tolist(), fused_scores[:k].tolist()))
+        
+        # One copy per document so the shared corpus data is never modified; add the score to help with ranking
+        batch_results.append([
+            dict(medical_data[doc_id], score=score)
+            for doc_id, score in ranked
+            if medical_data[doc_id] is not None
+        ])
     
     # Return unique documents
-    return results
+    return batch_results
 
-def search_clinical_trials(query, k=6):
-    """Search clinical trials index."""
-    global clinical_trial_faiss, clinical_trials_data, clinical_trial_chunks
-    
-    if clinical_trial_faiss is None or not clinical_trial_chunks:
-        return []
-    
-    # Generate embedding for query
-    query_embedding = get_embedding(query)
-    query_embedding_np = np.array([query_embedding]).astype('float32')
-    
-    # Normalize query vector for cosine similarity
-    normalized_query = normalize_vectors(query_embedding_np)
+def search_clinical_trials(query, n=3, query_vector=None, snapshot=None, aggregation=None, filters=None):
+    """Search clinical trials index for the `n` best distinct trials.
+    
+    Each trial is indexed as several aspect chunks; their scores are
+    combined per trial with `aggregation` ("max", "sum" or "weighted",
+    default TRIAL_SCORE_AGGREGATION). Pass the request's pinned `snapshot`
+    so all its searches see the same index version; defaults to the
+    current one. `filters` restricts the search to matching chunks, e.g.
+    {"condition": "asthma", "aspect": "eligibility"}.
+    """
+    # Use the caller's precomputed query vector, or embed the query (normalized for cosine similarity)
+    normalized_query = query_vector if query_vector is not None else embed_query(query)
+    return search_clinical_trials_batch(normalized_query, n, snapshot, aggregation, queries=[query], filters=filters)[0]
+
+def search_clinical_trials_batch(query_vectors, n=3, snapshot=None, aggregation=None, queries=None, filters=None):
+    """Search clinical trials for a batch of normalized query vectors.
+    
+    With the query texts in `queries`, vector and BM25 results are fused
+    as in search_medical_knowledge_batch. Returns one list of up to `n`
+    scored trials per query, best first.
+    """
+    snapshot = snapshot or get_snapshot()
+    if snapshot is None or len(snapshot.clinical_trials.chunks) == 0:
+        return [[] for _ in range(len(query_vectors))]
+    clinical_trials = snapshot.clinical_trials
+    params, bitmap, count = filtered_search_params("clinical_trials", clinical_trials, filters)
+    if count == 0:
+        return [[] for _ in range(len(query_vectors))]
+    hybrid = hybrid_enabled(queries)
+    depth = max(n, settings.HYBRID_CANDIDATES) if hybrid else n
+    
+    # Over-fetch chunks until enough distinct trials are found, and score each trial
+    with Span(INDEX_SEARCH_SECONDS, corpus="clinical_trials", retriever="vector"):
+        grouped = grouped_search(
+            clinical_trials.index, clinical_trials.chunks, query_vectors, depth,
+            aggregation=aggregation or settings.TRIAL_SCORE_AGGREGATION,
+            initial_k=depth * len(TRIAL_ASPECTS),
+            max_k=min(settings.GROUPED_SEARCH_MAX_K, count) if count is not None else None,
+            params=params
+        )
+    if hybrid:
+        lexical_rankings = lexical_search("clinical_trials", clinical_trials, queries, depth, bitmap)
+        grouped = [
+            tuple(ranking[:n] for ranking in reciprocal_rank_fusion([trial_ids, lexical_ranking]))
+            for (trial_ids, _), lexical_ranking in zip(grouped, lexical_rankings)
+        ]
     
-    # Perform search
-    distances, indices = clinical_trial_faiss.search(normalized_query, k)
-    
-    # Get results with scoring
-    trial_scores = {}
-    for i, idx in enumerate(indices[0]):
-        if idx < len(clinical_trial_chunks):
-            chunk = clinical_trial_chunks[idx]
-            trial_id = chunk["trial_id"]
-            
-            # Track the best score for each trial
-            current_score = float(distances[0][i])
-            if trial_id not in trial_scores or current_score > trial_scores[trial_id]:
-                trial_scores[trial_id] = current_score
-    
-    # Get unique trials with their best scores
-    results = []
-    for trial_id, score in trial_scores.items():
-        if trial_id < len(clinical_trials_data):
-            trial = clinical_trials_data[trial_id].copy()
-            trial["score"] = score
-            results.append(trial)
-    
-    # Sort by score (higher is better for inner product/cosine)
-    results.sort(key=lambda x: x["score"], reverse=True)
-    
-    # Return top 3 trials
-    return results[:3]
-
-# Initialize indices at import time to handle existing app behavior
-try:
-    build_indices()
-except Exception as e:
-    print(f"Warning: Failed to initialize indices at import time: {e}")
-    print("Use the /indices/build endpoint to build indices.")
\ No newline at end of file
+    # Return copies of the trials with their scores, best first
+    return [
+        [
+            dict(clinical_trials.data[trial_id], score=score)
+            for trial_id, score in zip(trial_ids.tolist(), scores.tolist())
+            if clinical_trials.data[trial_id] is not None
+        ]
+        for trial_ids, scores in grouped
+    ]
@@ -0,0 +1,106 @@
+import numpy as np
+from app.services.chunk_store import ASPECTS, DELETED
+from app.utils.config import settings
+
+AGGREGATIONS = ("max", "sum", "weighted")
+
+def aspect_weight_table(weights=None):
+    """Turn an {aspect: weight} mapping into an array indexed by aspect code (missing aspects weigh 1)."""
+    weights = settings.TRIAL_ASPECT_WEIGHTS if weights is None else weights
+    return np.array([weights.get(aspect, 1.0) for aspect in ASPECTS], dtype='float32')
+
+def aggregate_scores(doc_ids, scores, aggregation="max", aspects=None, aspect_weights=None):
+    """Reduce chunk scores to one score per document.
+
+    `doc_ids` and `scores` are parallel arrays of retrieved chunks (DELETED
+    entries are ignored). "max" keeps each document's best chunk, "sum"
+    adds up all of its retrieved chunks and "weighted" sums them weighted
+    by `aspect_weights[aspects]`. Returns (doc_ids, scores), best first.
+    """
+    valid = doc_ids != DELETED
+    doc_ids = doc_ids[valid]
+    scores = np.asarray(scores, dtype='float32')[valid]
+    if len(doc_ids) == 0:
+        return doc_ids, scores
+
+    unique, inverse = np.unique(doc_ids, return_inverse=True)
+    if aggregation == "max":
+        totals = np.full(len(unique), -np.inf, dtype='float32')
+        np.maximum.at(totals, inverse, scores)
+    elif aggregation == "sum":
+        totals = np.bincount(inverse, weights=scores, minlength=len(unique)).astype('float32')
+    elif aggregation == "weighted":
+        weights = aspect_weights if aspect_weights is not None else aspect_weight_table()
+        chunk_weights = weights[np.asarray(aspects)[valid]]
+        totals = np.bincount(inverse, weights=scores * chunk_weights, minlength=len(unique)).astype('float32')
+    else:
+        raise ValueError(f"Unknown aggregation {aggregation!r}, expected one of {', '.join(AGGREGATIONS)}")
+
+    # Stable sort keeps ties in document order
+    order = np.argsort(-totals, kind='stable')
+    return unique[order], totals[order]
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """Fuse several rankings of document IDs (best first) into one.
+
+    Each document scores the sum of 1 / (k + rank) over the rankings that
+    contain it, with ranks starting at 1 and k defaulting to RRF_K. Scores
+    are scaled so a document ranked first by every ranking scores 1.
+    Returns (doc_ids, scores), best first.
+    """
+    k = settings.RRF_K if k is None else k
+    rankings = [np.asarray(ranking, dtype='int64') for ranking in rankings]
+    if not any(len(ranking) for ranking in rankings):
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+
+    contributions = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    unique, inverse = np.unique(np.concatenate(rankings), return_inverse=True)
+    totals = (np.bincount(inverse, weights=contributions) * (k + 1) / len(rankings)).astype('float32')
+    order = np.argsort(-totals, kind='stable')
+    return unique[order], totals[order]
+
+def grouped_search(index, chunks, query_vectors, n, aggregation="max", initial_k=None, max_k=None, aspect_weights=None,
+                   params=None):
+    """Find the top `n` distinct documents for each of a batch of query vectors.
+
+    FAISS ranks chunks, and several chunks of one document often fill the
+    top results, so the search over-fetches: it starts at `initial_k`
+    chunks (default 2n) and doubles k, re-searching only the queries that
+    still need it, until the results cover `n` live documents, the index
+    has no more results, or `max_k` is reached. Chunk scores are then
+    reduced per document with aggregate_scores. `params` (FAISS search
+    parameters, e.g. with an ID selector) are passed to every search.
+    Returns one (doc_ids, scores) pair per query, best first, at most `n`
+    of each.
+    """
+    empty = (np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32'))
+    max_k = min(max_k or settings.GROUPED_SEARCH_MAX_K, index.ntotal)
+    k = min(initial_k or 2 * n, max_k)
+    if n <= 0 or k <= 0:
+        return [empty] * len(query_vectors)
+
+    results = [None] * len(query_vectors)
+    pending = np.arange(len(query_vectors))
+    while len(pending):
+        distances, rows = index.search(np.ascontiguousarray(query_vectors[pending]), k, params=params)
+        doc_ids = chunks.doc_ids_for(rows)
+        unfinished = []
+        for j, query in enumerate(pending.tolist()):
+            # Fewer than k results (-1 padding) means the index is exhausted for these settings
+            exhausted = k >= max_k or rows[j, -1] < 0
+            live = doc_ids[j][doc_ids[j] != DELETED]
+            if not exhausted and len(np.unique(live)) < n:
+                unfinished.append(query)
+                continue
+
+            aspects = None
+            if aggregation == "weighted":
+                aspects = np.zeros(k, dtype='uint8')
+                found = doc_ids[j] != DELETED
+                aspects[found] = chunks.aspects[rows[j][found]]
+            query_doc_ids, scores = aggregate_scores(doc_ids[j], distances[j], aggregation, aspects, aspect_weights)
+            results[query] = (query_doc_ids[:n], scores[:n])
+
+        pending = np.asarray(unfinished, dtype='int64')
+        k = min(2 * k, max_k)
+    return results
@@ -0,0 +1,319 @@
+import faiss
+import math
+import numpy as np
+from app.services.reranking_index import RerankingIndex
+from app.services.sharded_index import ShardedIndex
+from app.services.vector_store import VectorStoreBuilder
+from app.utils.config import settings
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "fp16")
+# Types storing lossy codes, whose results are re-ranked against full-precision vectors
+LOSSY_INDEX_TYPES = ("ivf_pq", "sq8", "fp16")
+
+def _ivf_nlist(n):
+    """Number of IVF lists: configured, or about 4*sqrt(n), with enough points per list to train."""
+    nlist = settings.IVF_NLIST or int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+def index_description(index_type, n, dimension):
+    """Return the faiss.index_factory description for an index type and corpus size.
+
+    IVF indices store caller-provided IDs natively; the others are wrapped in
+    an ID map so that every index type supports add_with_ids.
+    """
+    if index_type == "flat":
+        return "IDMap2,Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{_ivf_nlist(n)},Flat"
+    if index_type == "ivf_pq":
+        if dimension % settings.PQ_M != 0:
+            raise ValueError(f"PQ_M={settings.PQ_M} must divide the embedding dimension {dimension}")
+        return f"IVF{_ivf_nlist(n)},PQ{settings.PQ_M}x{settings.PQ_NBITS}"
+    if index_type == "hnsw":
+        return f"IDMap2,HNSW{settings.HNSW_M}"
+    if index_type == "sq8":
+        return "IDMap2,SQ8"
+    if index_type == "fp16":
+        return "IDMap2,SQfp16"
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+
+def _min_training_points(index_type):
+    if index_type == "ivf_pq":
+        return 2 ** settings.PQ_NBITS
+    if index_type == "ivf_flat":
+        return 39
+    if index_type == "sq8":
+        return 1
+    return 0
+
+def unwrap_index(index):
+    """Return the innermost index, looking through re-ranking, shards, ID maps and pre-transforms."""
+    if isinstance(index, RerankingIndex):
+        index = index.index
+    if isinstance(index, ShardedIndex):
+        index = index.shards[0]
+    index = faiss.downcast_index(index)
+    while hasattr(index, "index") and isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def apply_search_params(index):
+    """Apply the configured search-time settings (nprobe, efSearch) to an index."""
+    if isinstance(index, RerankingIndex):
+        index.factor = max(1, settings.RERANK_FACTOR)
+        apply_search_params(index.index)
+        return index
+    if isinstance(index, ShardedIndex):
+        for shard in index.shards:
+            apply_search_params(shard)
+        return index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = settings.IVF_NPROBE
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = settings.HNSW_EF_SEARCH
+    return index
+
+def search_parameters(index, selector=None, selectivity=1.0):
+    """Build per-search parameters restricting a search to the IDs accepted by `selector`.
+    
+    Explicit parameters replace the index's own nprobe/efSearch, so those
+    are carried over. Shards share one set of parameters. `selectivity` is
+    the share of vectors the selector accepts: IVF searches probe
+    proportionally more lists (up to all of them), so a selective filter
+    still finds about as many matches as an unfiltered search. HNSW keeps
+    its efSearch, so a very selective filter can return fewer than k
+    results from it.
+    """
+    if isinstance(index, RerankingIndex):
+        index = index.index
+    if isinstance(index, ShardedIndex):
+        index = index.shards[0]
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, math.ceil(ivf.nprobe / max(selectivity, 1e-9)))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(unwrap_index(index), faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=unwrap_index(index).hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The parameters only hold a raw pointer to the selector
+    params.referenced_objects = [selector]
+    return params
+
+def fit_reduction(sample, dimension):
+    """Fit a linear map to `dimension` dimensions that best preserves inner products on a sample.
+
+    This is PCA without centering: vectors are projected onto the top
+    eigenvectors of the second-moment matrix. Centering would shift each
+    inner product by a per-vector term and change rankings. Returns the
+    faiss.LinearTransform and the fraction of the sample's energy it keeps.
+    """
+    sample = np.asarray(sample, dtype='float32')
+    moments = (sample.T @ sample).astype('float64') / len(sample)
+    eigenvalues, eigenvectors = np.linalg.eigh(moments)
+    top = np.argsort(eigenvalues)[::-1][:dimension]
+    transform = faiss.LinearTransform(sample.shape[1], dimension, False)
+    faiss.copy_array_to_vector(np.ascontiguousarray(eigenvectors[:, top].T, dtype='float32').ravel(), transform.A)
+    transform.is_trained = True
+    retained = float(eigenvalues[top].sum() / eigenvalues.sum()) if eigenvalues.sum() > 0 else 1.0
+    return transform, retained
+
+def code_size(index):
+    """Bytes an index stores per vector (its codes, excluding IDs and graph links)."""
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    return inner.code_size
+
+def _recall_queries(vectors, num_queries=None):
+    """Pick a fixed random sample of vectors to use as recall queries."""
+    num_queries = min(num_queries or settings.RECALL_EVAL_QUERIES, len(vectors))
+    rng = np.random.default_rng(1)
+    return np.asarray(vectors[np.sort(rng.choice(len(vectors), num_queries, replace=False))], dtype='float32')
+
+class ExactTopK:
+    """Running exact inner-product top-k of fixed queries over vectors seen block by block."""
+
+    def __init__(self, queries, k):
+        self.queries = queries
+        self.k = k
+        self.count = 0
+        self.scores = np.full((len(queries), k), -np.inf, dtype='float32')
+        self.ids = np.full((len(queries), k), -1, dtype='int64')
+
+    def update(self, vectors, ids, block_size=65536):
+        """Merge a batch of vectors, with their FAISS IDs, into the running top-k."""
+        ids = np.asarray(ids, dtype='int64')
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype='float32')
+            scores = np.concatenate([self.scores, self.queries @ block.T], axis=1)
+            block_ids = np.broadcast_to(ids[start:start + len(block)], (len(self.queries), len(block)))
+            all_ids = np.concatenate([self.ids, block_ids], axis=1)
+            top = np.argpartition(-scores, self.k - 1, axis=1)[:, :self.k]
+            self.scores = np.take_along_axis(scores, top, axis=1)
+            self.ids = np.take_along_axis(all_ids, top, axis=1)
+            self.count += len(block)
+
+    def result(self):
+        """Return (scores, ids) of the top min(k, vectors seen), best first."""
+        k = min(self.k, self.count)
+        order = np.argsort(-self.scores, axis=1)[:, :k]
+        return np.take_along_axis(self.scores, order, axis=1), np.take_along_axis(self.ids, order, axis=1)
+
+def _recall(approx_ids, exact_ids):
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx_ids.tolist(), exact_ids.tolist()))
+    return hits / exact_ids.size if exact_ids.size else 1.0
+
+class IndexBuilder:
+    """Builds an index of the configured type from batches of (normalized) vectors.
+
+    Vectors are added as they arrive, so the corpus never has to be held in
+    memory as one matrix. Trainable index types buffer vectors until
+    INDEX_TRAIN_SAMPLE_SIZE have arrived (or the input ends) and are
+    trained on that leading sample. Corpora too small to train the
+    requested type get a flat index instead. With INDEX_SHARDS > 1 the
+    trained index is cloned into that many shards (see ShardedIndex).
+    With REDUCED_DIMENSION set, vectors are first projected to that many
+    dimensions by a transform fitted on the training sample (see
+    fit_reduction) and stored in the index, so queries are projected the
+    same way. Lossy types (LOSSY_INDEX_TYPES) and reduced indices also
+    stream the full-precision vectors to a temporary file under
+    `vector_dir` and re-rank their results against them (see
+    RerankingIndex), unless RERANK_FACTOR is 0. Recall against exact
+    search on the unreduced vectors is tracked on the fly for queries
+    sampled from the first batch.
+    """
+
+    def __init__(self, index_type=None, vector_dir=None):
+        self.index_type = index_type or settings.INDEX_TYPE
+        self.index = None
+        self.description = None
+        self.count = 0
+        self.lossy = False
+        self._pending = []
+        self._pending_count = 0
+        self._exact = None
+        self._vectors = None
+        self._reduction = None
+        if (self.index_type in LOSSY_INDEX_TYPES or settings.REDUCED_DIMENSION) and settings.RERANK_FACTOR > 0:
+            self._vectors = VectorStoreBuilder(vector_dir)
+
+    def add(self, vectors, ids):
+        """Add vectors with the given FAISS IDs."""
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        ids = np.asarray(ids, dtype='int64')
+        if len(vectors) == 0:
+            return
+
+        # An unreduced flat index is the recall baseline, so there's nothing to track
+        if self.index_type != "flat" or settings.REDUCED_DIMENSION:
+            if self._exact is None:
+                self._exact = ExactTopK(_recall_queries(vectors), settings.RECALL_EVAL_K)
+            self._exact.update(vectors, ids)
+        self.count += len(vectors)
+        if self._vectors is not None:
+            if ids[0] != len(self._vectors) or np.any(np.diff(ids) != 1):
+                raise ValueError("Re-ranked indices need consecutive IDs starting at 0")
+            self._vectors.add(vectors)
+
+        if self.index is not None:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._pending.append((vectors, ids))
+        self._pending_count += len(vectors)
+        if self._pending_count >= self._buffer_target():
+            self._create()
+
+    def _buffer_target(self):
+        """Number of vectors to buffer before the index can be created."""
+        needs_sample = _min_training_points(self.index_type) or settings.REDUCED_DIMENSION
+        return settings.INDEX_TRAIN_SAMPLE_SIZE if needs_sample else 0
+
+    def _create(self):
+        """Create (and train) the index from the buffered vectors, then add them."""
+        vectors = np.concatenate([v for v, _ in self._pending])
+        ids = np.concatenate([i for _, i in self._pending])
+        self._pending = []
+        n, dimension = vectors.shape
+
+        index_type = self.index_type
+        if n < _min_training_points(index_type):
+            logger.warning("Too few vectors to train the index type; using flat", index_type=index_type, vectors=n)
+            index_type = "flat"
+
+        sample_size = min(n, settings.INDEX_TRAIN_SAMPLE_SIZE)
+        sample = vectors[np.sort(np.random.default_rng(0).choice(n, sample_size, replace=False))]
+
+        transform = None
+        if 0 < settings.REDUCED_DIMENSION < dimension:
+            transform, retained = fit_reduction(sample, settings.REDUCED_DIMENSION)
+            self._reduction = {"reduced_dimension": settings.REDUCED_DIMENSION, "retained_energy": round(retained, 4)}
+            sample = transform.apply(sample)
+
+        self.lossy = index_type in LOSSY_INDEX_TYPES or transform is not None
+        self.description = index_description(index_type, n, transform.d_out if transform else dimension)
+        index = faiss.index_factory(transform.d_out if transform else dimension, self.description, faiss.METRIC_INNER_PRODUCT)
+
+        inner = unwrap_index(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efConstruction = settings.HNSW_EF_CONSTRUCTION
+
+        if not index.is_trained:
+            index.train(sample)
+        if transform is not None:
+            # Vectors and queries are projected by the index itself, and the transform is saved with it
+            index = faiss.IndexPreTransform(transform, index)
+
+        if settings.INDEX_SHARDS > 1:
+            # Clone before adding anything, so all shards share the trained quantizer
+            index = ShardedIndex([index] + [faiss.clone_index(index) for _ in range(settings.INDEX_SHARDS - 1)])
+        index.add_with_ids(vectors, ids)
+        self.index = index
+
+    def finish(self):
+        """Return the finished index and a report with its recall against flat search."""
+        if self.index is None:
+            if not self._pending:
+                raise ValueError("No vectors to index")
+            self._create()
+        apply_search_params(self.index)
+        shards = len(self.index.shards) if isinstance(self.index, ShardedIndex) else 1
+        logger.info("Created index", description=self.description, vectors=self.count, shards=shards)
+
+        inner = unwrap_index(self.index)
+        exact_ids = None
+        if self._exact is None:
+            recall_k, recall = min(settings.RECALL_EVAL_K, self.count), 1.0
+        else:
+            _, exact_ids = self._exact.result()
+            recall_k = exact_ids.shape[1]
+            _, approx_ids = self.index.search(self._exact.queries, recall_k)
+            recall = round(_recall(approx_ids, exact_ids), 4)
+
+        full_precision_bytes = self.count * self.index.d * 4
+        report = {
+            "index_type": type(inner).__name__,
+            "vectors": int(self.index.ntotal),
+            "recall_k": recall_k,
+            "recall": recall,
+            "shards": shards,
+            "vector_bytes": self.count * code_size(self.index),
+            "full_precision_bytes": full_precision_bytes,
+        }
+        report["memory_saved"] = round(1 - report["vector_bytes"] / full_precision_bytes, 4) if full_precision_bytes else 0.0
+        if self._reduction is not None:
+            report.update(self._reduction)
+
+        if self.lossy and self._vectors is not None:
+            self.index = RerankingIndex(self.index, self._vectors.build(), settings.RERANK_FACTOR)
+            report["rerank_factor"] = self.index.factor
+            report["first_pass_recall"] = recall
+            if exact_ids is not None:
+                _, approx_ids = self.index.search(self._exact.queries, recall_k)
+                report["recall"] = round(_recall(approx_ids, exact_ids), 4)
+        return self.index, report
@@ -0,0 +1,86 @@
+import itertools
+import time
+from app.utils.metrics import Gauge
+
+CORPUS_NAMES = ("medical", "clinical_trials")
+
+INDEX_VECTORS = Gauge("medflow_index_vectors", "Vectors in the published index, including stale ones not yet removed",
+                      labels=("corpus",))
+INDEX_CHUNKS = Gauge("medflow_index_chunks", "Live (not deleted) chunks in the published index", labels=("corpus",))
+INDEX_DOCUMENTS = Gauge("medflow_index_documents", "Live documents in the published index", labels=("corpus",))
+INDEX_VECTOR_BYTES = Gauge("medflow_index_vector_bytes", "In-memory size of the index's vector codes at build time",
+                           labels=("corpus",))
+SNAPSHOT_VERSION = Gauge("medflow_index_snapshot_version", "On-disk version of the published snapshot (0 if unsaved)")
+
+_generations = itertools.count(1)
+_current = None
+
+class CorpusIndex:
+    """One corpus' FAISS index together with its chunk store and source documents.
+
+    Row IDs returned by `index` and by the BM25 `lexical` index are rows of
+    `chunks` (a ChunkStore), and each chunk refers to its document by
+    position in `data`. Never modified once published; updates build a new
+    CorpusIndex instead.
+    """
+
+    __slots__ = ("index", "chunks", "data", "report", "lexical", "filters")
+
+    def __init__(self, index, chunks, data, report=None, lexical=None):
+        self.index = index
+        self.chunks = chunks
+        self.data = data
+        self.report = report or {}
+        self.lexical = lexical
+        # FilterIndex, built on first filtered search
+        self.filters = None
+
+class IndexSnapshot:
+    """An immutable, consistent version of all corpora.
+
+    New versions are published with a single reference swap. A request
+    calls get_snapshot() once and uses that object throughout, so a
+    concurrent rebuild can never mix row IDs from one version with chunks
+    from another, and no lock is needed on the query path. An old version
+    is freed when the last request holding it finishes.
+    """
+
+    __slots__ = ("generation", "version", "created_at") + CORPUS_NAMES
+
+    def __init__(self, medical, clinical_trials, version=None):
+        # In-process identity; `version` is the on-disk snapshot version, if saved
+        self.generation = next(_generations)
+        self.version = version
+        self.created_at = time.time()
+        self.medical = medical
+        self.clinical_trials = clinical_trials
+
+    def corpus(self, name):
+        """Get a corpus by name ("medical" or "clinical_trials")."""
+        if name not in CORPUS_NAMES:
+            raise ValueError(f"Unknown corpus {name!r}")
+        return getattr(self, name)
+
+    @property
+    def reports(self):
+        return {name: self.corpus(name).report for name in CORPUS_NAMES}
+
+def get_snapshot():
+    """Get the currently published snapshot, or None if no indices are loaded."""
+    return _current
+
+def publish_snapshot(snapshot):
+    """Make a snapshot the current one. Requests already holding the old one keep using it."""
+    global _current
+    _current = snapshot
+    record_snapshot_metrics(snapshot)
+
+def record_snapshot_metrics(snapshot):
+    """Update the index size gauges for a newly published snapshot."""
+    SNAPSHOT_VERSION.set(snapshot.version or 0)
+    for name in CORPUS_NAMES:
+        corpus = snapshot.corpus(name)
+        INDEX_VECTORS.set(corpus.index.ntotal, corpus=name)
+        INDEX_CHUNKS.set(corpus.chunks.live_count(), corpus=name)
+        INDEX_DOCUMENTS.set(sum(1 for doc in corpus.data if doc is not None), corpus=name)
+        INDEX_VECTOR_BYTES.set(corpus.report.get("vector_bytes", 0), corpus=name)
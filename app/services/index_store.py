@@ -0,0 +1,186 @@
+import faiss
+import json
+import os
+import shutil
+import time
+from app.services.chunk_store import ChunkStore
+from app.services.lexical_index import LexicalIndex
+from app.services.reranking_index import RerankingIndex
+from app.services.sharded_index import ShardedIndex
+from app.services.vector_store import VectorStore
+from app.utils.config import settings
+from app.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Bump whenever the on-disk layout changes; older snapshots are then ignored
+SNAPSHOT_FORMAT_VERSION = 4
+CURRENT_FILE = "CURRENT"
+
+def _write_json(path, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f)
+
+def _read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def _snapshot_versions(directory):
+    """List the snapshot versions present in the directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    versions = []
+    for name in os.listdir(directory):
+        if name.startswith("v") and name[1:].isdigit():
+            versions.append(int(name[1:]))
+    return sorted(versions)
+
+def read_index_mmap(path):
+    """Read a FAISS index, memory-mapping its storage where supported."""
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        # Index types without mmap support are read into memory
+        return faiss.read_index(path)
+
+def _index_shards(index):
+    if isinstance(index, RerankingIndex):
+        index = index.index
+    return index.shards if isinstance(index, ShardedIndex) else [index]
+
+def _index_path(snapshot_dir, name, shard, shards):
+    """Get the file of one shard of a corpus index; unsharded indices keep the plain name."""
+    if shards == 1:
+        return os.path.join(snapshot_dir, f"{name}.faiss")
+    return os.path.join(snapshot_dir, f"{name}.shard{shard}.faiss")
+
+def _corpus_files(name, info):
+    """List the files and directories of one corpus in a snapshot, given its manifest entry."""
+    shards = info.get("shards", 1)
+    paths = [os.path.basename(_index_path("", name, i, shards)) for i in range(shards)]
+    if info.get("reranked"):
+        paths.append(f"{name}_vectors")
+    return paths + [f"{name}_chunks", f"{name}_lexical", f"{name}_data.json"]
+
+def _link_or_copy(src, dst):
+    """Hard-link a file, copying it where links aren't supported."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def save_snapshot(directory, corpora, manifest, keep=2, base_version=None):
+    """Write a new snapshot of all corpora and make it the current one.
+
+    `corpora` maps a corpus name to a dict with "index", "chunks" (a
+    ChunkStore), "lexical" (a LexicalIndex) and "data", or to None for a
+    corpus unchanged since snapshot `base_version`. Snapshot files are never
+    modified, so an unchanged corpus's files are hard-linked from the base
+    snapshot rather than written again.
+    The snapshot is written to a temporary directory, renamed into place and
+    only then published through the CURRENT pointer, so readers never see a
+    partially written snapshot. Returns the new snapshot version.
+    """
+    os.makedirs(directory, exist_ok=True)
+    versions = _snapshot_versions(directory)
+    version = versions[-1] + 1 if versions else 1
+
+    base_dir = base_corpora = None
+    if any(corpus is None for corpus in corpora.values()):
+        base_dir = os.path.join(directory, f"v{base_version}")
+        base_corpora = _read_json(os.path.join(base_dir, "manifest.json"))["corpora"]
+
+    tmp_dir = os.path.join(directory, f".tmp-v{version}-{os.getpid()}")
+    os.makedirs(tmp_dir)
+    try:
+        corpus_entries = {}
+        for name, corpus in corpora.items():
+            if corpus is None:
+                corpus_entries[name] = base_corpora[name]
+                for path in _corpus_files(name, base_corpora[name]):
+                    src, dst = os.path.join(base_dir, path), os.path.join(tmp_dir, path)
+                    if os.path.isdir(src):
+                        shutil.copytree(src, dst, copy_function=_link_or_copy)
+                    else:
+                        _link_or_copy(src, dst)
+                continue
+
+            shards = _index_shards(corpus["index"])
+            for i, shard in enumerate(shards):
+                faiss.write_index(shard, _index_path(tmp_dir, name, i, len(shards)))
+            if isinstance(corpus["index"], RerankingIndex):
+                corpus["index"].vectors.save(os.path.join(tmp_dir, f"{name}_vectors"))
+            corpus["chunks"].save(os.path.join(tmp_dir, f"{name}_chunks"))
+            corpus["lexical"].save(os.path.join(tmp_dir, f"{name}_lexical"))
+            _write_json(os.path.join(tmp_dir, f"{name}_data.json"), corpus["data"])
+            corpus_entries[name] = {
+                "chunks": corpus["chunks"].live_count(),
+                # Deleted entries are kept as None until the next full build
+                "documents": sum(1 for doc in corpus["data"] if doc is not None),
+                "shards": len(_index_shards(corpus["index"])),
+                "reranked": isinstance(corpus["index"], RerankingIndex),
+            }
+
+        manifest = dict(manifest)
+        manifest.update({
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version": version,
+            "created_at": time.time(),
+            "corpora": corpus_entries,
+        })
+        _write_json(os.path.join(tmp_dir, "manifest.json"), manifest)
+        os.rename(tmp_dir, os.path.join(directory, f"v{version}"))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # Atomically repoint CURRENT at the new snapshot
+    pointer_tmp = os.path.join(directory, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(f"v{version}")
+    os.replace(pointer_tmp, os.path.join(directory, CURRENT_FILE))
+
+    # Drop old snapshots, keeping the newest `keep` (including this one)
+    for old in _snapshot_versions(directory)[:-keep]:
+        shutil.rmtree(os.path.join(directory, f"v{old}"), ignore_errors=True)
+
+    return version
+
+def load_snapshot(directory, expected=None):
+    """Load the current snapshot, or return None if there is no usable one.
+
+    `expected` holds manifest fields (e.g. the embedding model) that must
+    match for the snapshot to be used. Returns (manifest, corpora) where
+    corpora has the same shape as for save_snapshot.
+    """
+    pointer = os.path.join(directory, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, "r") as f:
+        snapshot_dir = os.path.join(directory, f.read().strip())
+
+    manifest = _read_json(os.path.join(snapshot_dir, "manifest.json"))
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        logger.warning("Ignoring snapshot with another format version", snapshot=snapshot_dir,
+                       format_version=manifest.get('format_version'))
+        return None
+    for field, value in (expected or {}).items():
+        if manifest.get(field) != value:
+            logger.warning("Ignoring incompatible snapshot", snapshot=snapshot_dir, field=field,
+                           found=manifest.get(field), expected=value)
+            return None
+
+    corpora = {}
+    for name, info in manifest["corpora"].items():
+        shards = [read_index_mmap(_index_path(snapshot_dir, name, i, info.get("shards", 1))) for i in range(info.get("shards", 1))]
+        index = shards[0] if len(shards) == 1 else ShardedIndex(shards)
+        if info.get("reranked"):
+            index = RerankingIndex(index, VectorStore.load(os.path.join(snapshot_dir, f"{name}_vectors")), settings.RERANK_FACTOR)
+        corpora[name] = {
+            "index": index,
+            "chunks": ChunkStore.load(os.path.join(snapshot_dir, f"{name}_chunks")),
+            "lexical": LexicalIndex.load(os.path.join(snapshot_dir, f"{name}_lexical")),
+            "data": _read_json(os.path.join(snapshot_dir, f"{name}_data.json")),
+        }
+    return manifest, corpora
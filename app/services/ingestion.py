@@ -0,0 +1,77 @@
+import itertools
+import json
+import re
+
+# Whitespace between records; JSON arrays also separate them with commas
+_JSONL_SEPARATOR = re.compile(r"\s*")
+_ARRAY_SEPARATOR = re.compile(r"[\s,]*")
+
+def iter_json_records(path, buffer_size=1 << 20, on_progress=None):
+    """Yield the objects of a JSON array or JSONL file one at a time.
+
+    The format is detected from the first character: "[" starts an array,
+    anything else is read as a sequence of objects separated by whitespace
+    (JSONL/NDJSON). Only the read buffer and the object being decoded are
+    held in memory, so files much larger than RAM can be ingested. Raises
+    ValueError if the file is not valid JSON. `on_progress`, if given, is
+    called with the file offset reached after each record, which measures
+    progress through the file without a second pass. Offsets count
+    characters, which equal bytes for ASCII (escaped) JSON.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(buffer_size)
+        eof = not buffer
+        # Characters of the file before the start of the buffer
+        offset = 0
+        pos = _JSONL_SEPARATOR.match(buffer).end()
+        in_array = buffer.startswith("[", pos)
+        if in_array:
+            pos += 1
+        separator = _ARRAY_SEPARATOR if in_array else _JSONL_SEPARATOR
+
+        while True:
+            pos = separator.match(buffer, pos).end()
+            if pos == len(buffer) or in_array and buffer[pos] == "]":
+                if pos < len(buffer):
+                    # End of the array; only whitespace may follow
+                    trailing = buffer[pos + 1:] + f.read()
+                    if trailing.strip():
+                        raise ValueError(f"Unexpected data after the JSON array in {path}")
+                    return
+                if eof:
+                    if in_array:
+                        raise ValueError(f"Unterminated JSON array in {path}")
+                    return
+            else:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    # The record may continue past the buffer; read more unless at the end
+                    if eof:
+                        raise ValueError(f"Invalid JSON in {path}: {e.msg}") from e
+                else:
+                    if not isinstance(record, dict):
+                        raise ValueError(f"Expected JSON objects in {path}, got {type(record).__name__}")
+                    if on_progress:
+                        on_progress(offset + end)
+                    yield record
+                    pos = end
+                    continue
+
+            # Drop the consumed part of the buffer and read the next block,
+            # growing the read size for records larger than the buffer
+            more = f.read(max(buffer_size, len(buffer) - pos))
+            eof = not more
+            offset += pos
+            buffer = buffer[pos:] + more
+            pos = 0
+
+def batched(iterable, size):
+    """Yield lists of up to `size` consecutive items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
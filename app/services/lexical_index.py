@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+import numpy as np
+from app.utils.config import settings
+from app.utils.term_matcher import tokenize
+
+# Hyphenated or dotted codes such as drug codes, trial IDs or "140/90"
+COMPOUND_PATTERN = re.compile(r"\w+(?:[-/.]\w+)+")
+
+def lexical_terms(text):
+    """Split text into the terms indexed for lexical search.
+
+    These are the lowercase words plus each compound code as a whole, so
+    "XYZ-123" matches on "xyz", "123" and, most selectively, "xyz-123".
+    """
+    return tokenize(text) + COMPOUND_PATTERN.findall(text.lower())
+
+def _postings(term_ids, rows, tfs, num_terms):
+    """Group (term, row, tf) triples by term into CSR form: (indptr, rows, tfs)."""
+    # Stable, so each term's rows stay in ascending order
+    order = np.argsort(term_ids, kind='stable')
+    indptr = np.zeros(num_terms + 1, dtype='int64')
+    np.cumsum(np.bincount(term_ids, minlength=num_terms), out=indptr[1:])
+    return indptr, rows[order], tfs[order]
+
+class LexicalIndex:
+    """BM25 inverted index over a corpus' chunk texts.
+
+    Row i is the chunk with FAISS ID i, so lexical and vector results refer
+    to the same ChunkStore rows. Postings are kept per term in CSR arrays
+    (rows and term frequencies), so a search only touches the postings of
+    the query's terms. Loaded indices are memory-mapped. Like ChunkStore,
+    it is never modified once built; updates append a segment and return a
+    new index. Deleted chunks keep their postings (callers skip them
+    through the ChunkStore) and still count towards the BM25 statistics
+    until the next full build.
+    """
+
+    __slots__ = ("lengths", "total_length", "_segments")
+
+    def __init__(self, lengths, segments):
+        self.lengths = lengths
+        self.total_length = float(np.sum(lengths, dtype='float64'))
+        # Postings as (first row, vocabulary, indptr, rows, tfs); rows are relative to first row
+        self._segments = tuple(segments)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, text, k=None):
+        """Score every chunk containing a query term with BM25.
+
+        Returns (rows, scores) of the best `k` chunks (all matching chunks
+        if k is None), best first.
+        """
+        k1, b = settings.BM25_K1, settings.BM25_B
+        num_rows = len(self.lengths)
+        row_parts, score_parts = [], []
+        for term in dict.fromkeys(lexical_terms(text)):
+            rows, tfs = self._term_postings(term)
+            if len(rows) == 0:
+                continue
+            idf = math.log(1 + (num_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norms = k1 * (1 - b + b * self.lengths[rows] / (self.total_length / num_rows))
+            row_parts.append(rows)
+            score_parts.append(idf * tfs * (k1 + 1) / (tfs + norms))
+
+        if not row_parts:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+        rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype('float32')
+        if k is not None and k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
+
+    def _term_postings(self, term):
+        """Get the (rows, tfs) of all chunks containing a term, across segments."""
+        rows, tfs = [], []
+        for first, vocabulary, indptr, segment_rows, segment_tfs in self._segments:
+            term_id = vocabulary.get(term)
+            if term_id is not None:
+                start, end = indptr[term_id], indptr[term_id + 1]
+                rows.append(segment_rows[start:end].astype('int64') + first)
+                tfs.append(segment_tfs[start:end])
+        if not rows:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+        return np.concatenate(rows), np.concatenate(tfs)
+
+    def updated(self, new_texts=()):
+        """Return a copy with new chunk texts appended as the next rows.
+
+        Existing postings are shared with the new index rather than copied.
+        """
+        if not new_texts:
+            return self
+        builder = LexicalIndexBuilder()
+        builder.add(new_texts)
+        added = builder.build()
+        segments = list(self._segments)
+        segments.extend((first + len(self), *postings) for first, *postings in added._segments)
+        return LexicalIndex(np.concatenate([self.lengths, added.lengths]), segments)
+
+    def save(self, directory):
+        """Write the index to a directory, merging its segments into one."""
+        os.makedirs(directory, exist_ok=True)
+        vocabulary = {}
+        term_ids, rows, tfs = [], [], []
+        for first, segment_vocabulary, indptr, segment_rows, segment_tfs in self._segments:
+            # Map the segment's term IDs to IDs in the merged vocabulary
+            local_terms = sorted(segment_vocabulary, key=segment_vocabulary.get)
+            mapping = np.fromiter((vocabulary.setdefault(term, len(vocabulary)) for term in local_terms),
+                                  dtype='int64', count=len(local_terms))
+            term_ids.append(np.repeat(mapping, np.diff(indptr)))
+            rows.append(np.asarray(segment_rows, dtype='int64') + first)
+            tfs.append(np.asarray(segment_tfs, dtype='float32'))
+
+        indptr, rows, tfs = _postings(np.concatenate(term_ids), np.concatenate(rows).astype('int32'),
+                                      np.concatenate(tfs), len(vocabulary))
+        np.save(os.path.join(directory, "indptr.npy"), indptr)
+        np.save(os.path.join(directory, "rows.npy"), rows)
+        np.save(os.path.join(directory, "tfs.npy"), tfs)
+        np.save(os.path.join(directory, "lengths.npy"), np.asarray(self.lengths, dtype='float32'))
+        with open(os.path.join(directory, "vocabulary.json"), "w") as f:
+            # Terms in term ID order
+            json.dump(list(vocabulary), f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load an index written by save(), memory-mapping its arrays."""
+        with open(os.path.join(directory, "vocabulary.json"), "r") as f:
+            vocabulary = {term: term_id for term_id, term in enumerate(json.load(f))}
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+            for name in ("indptr", "rows", "tfs", "lengths")
+        }
+        return cls(arrays["lengths"], [(0, vocabulary, arrays["indptr"], arrays["rows"], arrays["tfs"])])
+
+class LexicalIndexBuilder:
+    """Accumulates chunk texts batch by batch into a LexicalIndex."""
+
+    def __init__(self):
+        self.count = 0
+        self._vocabulary = {}
+        self._term_ids = []
+        self._rows = []
+        self._tfs = []
+        self._lengths = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, texts):
+        """Index a batch of texts; their rows follow the ones added before."""
+        term_ids, rows, tfs, lengths = [], [], [], []
+        for row, text in enumerate(texts, self.count):
+            terms = lexical_terms(text)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                rows.append(row)
+                tfs.append(tf)
+        self._term_ids.append(np.asarray(term_ids, dtype='int64'))
+        self._rows.append(np.asarray(rows, dtype='int32'))
+        self._tfs.append(np.asarray(tfs, dtype='float32'))
+        self._lengths.append(np.asarray(lengths, dtype='float32'))
+        self.count += len(lengths)
+
+    def build(self):
+        """Return the finished LexicalIndex."""
+        def column(parts, dtype):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        indptr, rows, tfs = _postings(column(self._term_ids, 'int64'), column(self._rows, 'int32'),
+                                      column(self._tfs, 'float32'), len(self._vocabulary))
+        return LexicalIndex(column(self._lengths, 'float32'), [(0, dict(self._vocabulary), indptr, rows, tfs)])
@@ -1,37 +1,79 @@
-import openai
-import re
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from app.services.faiss_setup import (
-    medical_faiss, clinical_trial_faiss, clinical_trials_data, 
-    get_indices_status, build_indices, search_medical_knowledge, search_clinical_trials
+    get_indices_status, search_medical_knowledge, search_clinical_trials,
+    aembed_queries, search_medical_knowledge_batch, search_clinical_trials_batch, count_cache_lookup
 )
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.build_jobs import start_build
+from app.services.index_snapshot import get_snapshot
+from app.services.medical_terms import match_terms, CONDITION, MEDICAL_TERM, TRIAL_REQUEST, TREATMENT
+from app.services.openai_clients import get_async_client
+from app.services.query_context import QueryContext
+from app.services.sharded_index import limit_faiss_threads
 from app.utils.config import settings
+from app.utils.log import get_logger
+from app.utils.metrics import Counter, Histogram, Span
+
+logger = get_logger(__name__)
+
+# FAISS releases the GIL while searching, so searches run on a small thread
+# pool instead of blocking the event loop
+search_executor = ThreadPoolExecutor(max_workers=settings.SEARCH_THREADS, thread_name_prefix="faiss-search",
+                                     initializer=limit_faiss_threads, initargs=(settings.FAISS_OMP_THREADS,))
+
+# Semantic cache of recent answers, created on first use when enabled
+answer_cache = None
+
+QUERY_STAGE_SECONDS = Histogram("medflow_query_stage_duration_seconds", "Stages of answering a query", labels=("stage",))
+LLM_SECONDS = Histogram("medflow_llm_duration_seconds", "Chat completion calls (mode: complete or stream)", labels=("model", "mode"))
+LLM_TOKENS = Counter("medflow_llm_tokens", "Tokens used by chat completions (kind: prompt or completion)", labels=("model", "kind"))
+
+async def run_search(search_fn, *args, **kwargs):
+    """Run a blocking index search on the search thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(search_executor, partial(search_fn, *args, **kwargs))
 
 def ensure_indices_built():
-    """Ensure that indices are built before trying to use them."""
+    """Ensure that indices are built before trying to use them.
+    
+    Blocks until they are. Concurrent callers join the same background
+    build instead of each starting one.
+    """
     status = get_indices_status()
     if not status["medical_index_built"] or not status["clinical_trials_index_built"]:
-        print("Indices not built or not fully initialized. Attempting to build...")
-        return build_indices()
+        job, started = start_build(force=False)
+        if started:
+            logger.warning("Indices not built or not fully initialized, building", job=job.id)
+        return job.wait()
     return status
 
 def check_for_clinical_trial_request(query: str) -> bool:
-    """Check if the query is explicitly asking for clinical trials."""
-    # Simple keyword matching for clinical trial requests
-    trial_keywords = [
-        'clinical trial', 'clinical trials', 'trials', 'trial', 'study', 'studies',
-        'research study', 'research trial', 'participating', 'participate in', 
-        'enroll in', 'treatment option', 'experimental treatment'
-    ]
+    """Check if the query is explicitly asking for clinical trials.
+
+    >>> check_for_clinical_trial_request("I have diabetes, what treatments are available?")
+    True
+    >>> check_for_clinical_trial_request("My hypertension medications stopped working")
+    True
+    >>> check_for_clinical_trial_request("heart diseases run in my family, any options?")
+    True
+    >>> check_for_clinical_trial_request("Are there studies on strokes?")
+    True
+    >>> check_for_clinical_trial_request("What therapies help Parkinson's patients?")
+    True
+    >>> check_for_clinical_trial_request("What causes a painful knee?")
+    False
+    """
+    categories = {match.category for match in match_terms(query)}
     
-    # Check for keyword matches
-    query_lower = query.lower()
-    for keyword in trial_keywords:
-        if keyword in query_lower:
-            return True
+    # Check for clinical trial request keywords
+    if TRIAL_REQUEST in categories:
+        return True
     
     # If query mentions medical conditions, there's an implicit need for trials
-    medical_terms = extract_medical_terms(query)
-    if medical_terms and any(term in query_lower for term in ['treatment', 'medication', 'therapy', 'options']):
+    if categories & {CONDITION, MEDICAL_TERM} and TREATMENT in categories:
         return True
     
     # Not explicitly asking for clinical trials
@@ -39,45 +81,27 @@ def check_for_clinical_trial_request(query: str) -> bool:
 
 def extract_condition_from_query(query: str) -> str:
     """Extract the main medical condition from the query."""
-    # Common medical conditions to look for
-    conditions = [
-        'diabetes', 'hypertension', 'blood pressure', 'cancer', 'arthritis',
-        'asthma', 'heart disease', 'obesity', 'depression', 'anxiety',
-        'alzheimer', 'parkinson', 'stroke', 'copd', 'allergies'
-    ]
-    
-    # Check for condition matches
-    query_lower = query.lower()
-    for condition in conditions:
-        if condition in query_lower:
+    for match in match_terms(query):
+        if match.category == CONDITION:
             # Get some context around the condition
-            start = max(0, query_lower.find(condition) - 10)
-            end = min(len(query_lower), query_lower.find(condition) + len(condition) + 10)
-            return query_lower[start:end]
+            start = max(0, match.start - 10)
+            end = min(len(query), match.end + 10)
+            return query[start:end].lower()
     
     # No specific condition found, use the whole query
     return query
 
 def extract_medical_terms(query: str) -> list:
     """Extract potential medical condition terms from the query."""
-    # Common medical condition keywords
-    condition_patterns = [
-        r'diabetes', r'hypertension', r'blood pressure', r'cancer', r'arthritis',
-        r'asthma', r'heart disease', r'obesity', r'depression', r'anxiety',
-        r'alzheimer', r'parkinson', r'stroke', r'copd', r'allergies',
-        r'pain', r'infection', r'disease', r'disorder', r'syndrome'
-    ]
-    
-    # Extract words around the conditions
+    # Extract words around each distinct condition or medical term (context window)
     extracted_terms = []
-    for pattern in condition_patterns:
-        match = re.search(pattern, query.lower())
-        if match:
-            # Get words around the match (context window)
-            start = max(0, match.start() - 20)
-            end = min(len(query), match.end() + 20)
-            context = query[start:end].strip()
-            extracted_terms.append(context)
+    seen_terms = set()
+    for match in match_terms(query):
+        if match.category in (CONDITION, MEDICAL_TERM) and match.term not in seen_terms:
+            seen_terms.add(match.term)
+            start = max(0, match.start - 20)
+            end = min(len(query), match.end + 20)
+            extracted_terms.append(query[start:end].strip())
     
     # If we found specific terms, return them, otherwise return empty list
     return extracted_terms
@@ -92,95 +116,323 @@ def expand_query_with_medical_terms(query: str) -> str:
     expanded_query = query + " " + " ".join(terms)
     return expanded_query
 
-def find_clinical_trials(query: str, max_trials: int = 3):
-    """Search for relevant clinical trials based on the query."""
-    # First check if there are any medical terms in the query
-    conditions = extract_medical_terms(query)
-    expanded_query = expand_query_with_medical_terms(query)
+async def find_clinical_trials(query: str, max_trials: int = 3, context: QueryContext = None, snapshot=None):
+    """Search for relevant clinical trials based on the query.
     
-    # Perform the search with expanded query for better results
-    trials = search_clinical_trials(expanded_query, k=max_trials*2)
-    
-    # If no direct matches, try searching with just the medical terms
-    if not trials and conditions:
-        condition_query = " ".join(conditions)
-        print(f"No direct matches, trying with condition terms: {condition_query}")
-        trials = search_clinical_trials(condition_query, k=max_trials)
-    
-    # If still no results, try a broader search
-    if not trials:
-        # Extract any condition-like words
-        words = re.findall(r'\b\w+\b', query.lower())
-        medical_words = [w for w in words if len(w) > 3]  # Filter short words
-        if medical_words:
-            broader_query = " ".join(medical_words)
-            print(f"Trying broader search with: {broader_query}")
-            trials = search_clinical_trials(broader_query, k=max_trials)
+    `context` carries the already embedded expanded query; if omitted, the
+    query is expanded and embedded here. The search uses `snapshot` (the
+    request's pinned index version), defaulting to the current one. Vector
+    and keyword results are fused in one pass, so exact terms such as drug
+    codes match without further embedding calls.
+    """
+    snapshot = snapshot or get_snapshot()
+    if context is None:
+        context = expand_query(query)
     
+    # Perform the search with expanded query for better results
+    query_vector = await context.aget_vector()
+    with Span(QUERY_STAGE_SECONDS, stage="trial_search"):
+        trials = await run_search(search_clinical_trials, context.text, n=max_trials, query_vector=query_vector, snapshot=snapshot)
     return trials[:max_trials]
 
-def process_medical_query(query: str):
-    """Process a medical query using FAISS indices for knowledge retrieval."""
-    # First, ensure indices are built
-    status = ensure_indices_built()
+def expand_query(query):
+    """Expand a query with its medical terms, as a QueryContext for its searches."""
+    with Span(QUERY_STAGE_SECONDS, stage="query_expansion"):
+        return QueryContext(expand_query_with_medical_terms(query))
+
+CHAT_MODEL = "gpt-4.1-2025-04-14"
+SYSTEM_PROMPT = ("You are a helpful medical assistant. "
+                 "Provide accurate, informative responses to medical queries based on the provided context.")
+INDICES_UNAVAILABLE_ANSWER = ("Sorry, the medical knowledge base could not be initialized. "
+                              "Please try rebuilding the indices using the /indices/build endpoint.")
+
+async def indices_available():
+    """Ensure indices are built and report whether they can be searched."""
+    # This may build the indices, so keep it off the event loop
+    status = await asyncio.to_thread(ensure_indices_built)
+    return "error" not in status and get_indices_status()["medical_index_built"]
+
+async def retrieve_for_query(query: str, context: QueryContext = None, snapshot=None):
+    """Run retrieval for a query and build the LLM prompt.
+    
+    `context` is the expanded query (built here if omitted) and `snapshot`
+    the index version to search (default: the current one). Returns the
+    prompt and the clinical trials to show the user (None unless the query
+    asks for trials).
+    """
+    # Expand query with medical terms for better search, and embed it
+    # once to share across all index searches
+    if context is None:
+        context = expand_query(query)
+    expanded_query = context.text
+    
+    # Check for explicit clinical trial request
+    is_requesting_trials = check_for_clinical_trial_request(query)
+    logger.debug("Checked for clinical trial request", query=query, expanded_query=expanded_query,
+                 requesting_trials=is_requesting_trials)
+    
+    # Pin one index version for all of this request's searches
+    snapshot = snapshot or get_snapshot()
+    
+    # Always check for clinical trials that match query (but only return if requested),
+    # and fetch relevant medical knowledge with the expanded query, concurrently
+    with Span(QUERY_STAGE_SECONDS, stage="retrieval"):
+        query_vector = await context.aget_vector()
+        clinical_trials, medical_context = await asyncio.gather(
+            find_clinical_trials(query, context=context, snapshot=snapshot),
+            run_search(search_medical_knowledge, expanded_query, k=4, query_vector=query_vector, snapshot=snapshot)
+        )
+    logger.info("Retrieved context", requesting_trials=is_requesting_trials, clinical_trials=len(clinical_trials),
+                medical_documents=len(medical_context))
+    
+    # Construct prompt with medical knowledge and clinical trials if applicable
+    shown_trials = clinical_trials if is_requesting_trials else None
+    with Span(QUERY_STAGE_SECONDS, stage="prompt_construction"):
+        prompt = construct_prompt(query, medical_context, shown_trials)
+    return prompt, shown_trials
+
+async def retrieve_for_queries(queries, snapshot=None):
+    """Batch variant of retrieve_for_query.
+    
+    All queries are embedded together and each index is searched once for
+    the whole batch. Returns a (prompt, shown_trials) pair per query.
+    """
+    if not queries:
+        return []
+    expanded_queries = [expand_query_with_medical_terms(query) for query in queries]
+    snapshot = snapshot or get_snapshot()
     
-    # Check if indices are properly built
-    if medical_faiss is None or "error" in status:
+    with Span(QUERY_STAGE_SECONDS, stage="batch_retrieval"):
+        query_vectors = await aembed_queries(expanded_queries)
+        medical_contexts, trial_results = await asyncio.gather(
+            run_search(search_medical_knowledge_batch, query_vectors, k=4, snapshot=snapshot, queries=expanded_queries),
+            run_search(search_clinical_trials_batch, query_vectors, n=3, snapshot=snapshot, queries=expanded_queries)
+        )
+    
+    retrieved = []
+    for query, medical_context, clinical_trials in zip(queries, medical_contexts, trial_results):
+        shown_trials = clinical_trials if check_for_clinical_trial_request(query) else None
+        with Span(QUERY_STAGE_SECONDS, stage="prompt_construction"):
+            retrieved.append((construct_prompt(query, medical_context, shown_trials), shown_trials))
+    return retrieved
+
+def build_messages(prompt):
+    """Build the chat messages for a prompt."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+async def process_medical_query(query: str):
+    """Process a medical query using FAISS indices for knowledge retrieval."""
+    if not await indices_available():
         return {
-            "answer": "Sorry, the medical knowledge base could not be initialized. Please try rebuilding the indices using the /indices/build endpoint.",
+            "answer": INDICES_UNAVAILABLE_ANSWER,
             "clinical_trials": None
         }
     
     try:
-        # Check if this is a request for clinical trials
-        print("\n=== CHECKING FOR CLINICAL TRIAL REQUEST ===")
-        print("Original query:", query)
-        
-        # Expand query with medical terms for better search
-        expanded_query = expand_query_with_medical_terms(query)
-        print(f"Expanded query: {expanded_query}")
-        
-        # Check for explicit clinical trial request
-        is_requesting_trials = check_for_clinical_trial_request(query)
-        print(f"Is requesting trials: {is_requesting_trials}")
-        
-        # Always check for clinical trials that match query (but only return if requested)
-        clinical_trials = find_clinical_trials(expanded_query)
-        print(f"Found {len(clinical_trials)} relevant clinical trials")
+        # Pin one index version for the cache lookup and all searches
+        snapshot = get_snapshot()
+        context = expand_query(query)
+        cache_key = answer_cache_key(query, await context.aget_vector(), snapshot)
+        cached = lookup_cached_answer(cache_key)
+        if cached is not None:
+            return cached
         
-        # Fetch relevant medical knowledge with expanded query for better results
-        medical_context = search_medical_knowledge(expanded_query, k=4)
-        print(f"Retrieved {len(medical_context)} relevant medical documents")
+        prompt, clinical_trials = await retrieve_for_query(query, context=context, snapshot=snapshot)
         
-        # Construct prompt with medical knowledge and clinical trials if applicable
-        prompt = construct_prompt(query, medical_context, clinical_trials if is_requesting_trials else None)
-        
-        # Get answer from OpenAI
-        openai.api_key = settings.OPENAI_KEY
-        completion = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
+        response = {
+            "answer": await complete_prompt(prompt),
+            "clinical_trials": clinical_trials
+        }
+        cache_answer(cache_key, response)
+        return response
+    except Exception as e:
+        return error_response(e)
+
+def get_answer_cache():
+    """Get the semantic answer cache, or None if it is disabled."""
+    global answer_cache
+    if answer_cache is None and settings.ANSWER_CACHE_ENABLED:
+        answer_cache = SemanticAnswerCache(
+            settings.ANSWER_CACHE_SIZE,
+            settings.ANSWER_CACHE_THRESHOLD,
+            settings.ANSWER_CACHE_TTL,
+            settings.ANSWER_CACHE_PATH or None
+        )
+    return answer_cache
+
+def answer_cache_key(query, query_vector, snapshot):
+    """Key a query's answer by its embedding, the index version and whether trials were requested.
+    
+    Returns None when answers can't be cached: the cache is disabled, or
+    the snapshot was never saved and so has no version to tie answers to.
+    """
+    if get_answer_cache() is None or snapshot is None or snapshot.version is None:
+        return None
+    return query_vector, snapshot.version, check_for_clinical_trial_request(query)
+
+def lookup_cached_answer(cache_key):
+    """Get the cached response for a key from answer_cache_key, or None."""
+    if cache_key is None:
+        return None
+    query_vector, version, variant = cache_key
+    with Span(QUERY_STAGE_SECONDS, stage="answer_cache_lookup"):
+        response = get_answer_cache().lookup(query_vector, version, variant)
+    count_cache_lookup("answer", response is not None)
+    return response
+
+def cache_answer(cache_key, response):
+    """Remember a successful response under a key from answer_cache_key."""
+    if cache_key is not None:
+        query_vector, version, variant = cache_key
+        get_answer_cache().put(query_vector, version, response, variant=variant)
+
+async def answer_cache_keys(queries, snapshot):
+    """Batch variant of answer_cache_key, embedding all queries together."""
+    if get_answer_cache() is None or snapshot is None or snapshot.version is None:
+        return [None] * len(queries)
+    query_vectors = await aembed_queries([expand_query_with_medical_terms(query) for query in queries])
+    return [answer_cache_key(query, query_vectors[i:i + 1], snapshot) for i, query in enumerate(queries)]
+
+async def complete_prompt(prompt):
+    """Get the model's answer for a prompt from OpenAI."""
+    with Span(LLM_SECONDS, model=CHAT_MODEL, mode="complete"):
+        completion = await get_async_client().chat.completions.create(
+            model=CHAT_MODEL,
             temperature=0,
-            messages=[
-                {"role": "system", "content": "You are a helpful medical assistant. "
-                 "Provide accurate, informative responses to medical queries based on the provided context."},
-                {"role": "user", "content": prompt}
-            ]
+            messages=build_messages(prompt)
         )
+    count_llm_tokens(getattr(completion, "usage", None))
+    return completion.choices[0].message.content.strip()
+
+def count_llm_tokens(usage):
+    """Count a completion's token usage for /metrics (if the response reported it)."""
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens, model=CHAT_MODEL, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens, model=CHAT_MODEL, kind="completion")
+
+def error_response(e):
+    """Build the response returned for a query that failed."""
+    logger.error("Error processing query", error=str(e))
+    return {
+        "answer": f"An error occurred while processing your query: {str(e)}",
+        "clinical_trials": None
+    }
+
+async def process_medical_queries(queries):
+    """Process many medical queries, yielding (position, response) in input order.
+    
+    Retrieval runs for BATCH_RETRIEVAL_SIZE queries at a time (one
+    embedding pass and one search per index), and at most
+    BATCH_LLM_CONCURRENCY completions run at once. Answers are yielded as
+    soon as every earlier one is done, so results stream while later
+    queries are still being processed. A failing query gets an error
+    response without failing the batch.
+    """
+    if not await indices_available():
+        for i in range(len(queries)):
+            yield i, {"answer": INDICES_UNAVAILABLE_ANSWER, "clinical_trials": None}
+        return
+    
+    semaphore = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+    
+    async def answer(query, prompt, clinical_trials, cache_key):
+        async with semaphore:
+            try:
+                response = {"answer": await complete_prompt(prompt), "clinical_trials": clinical_trials}
+            except Exception as e:
+                return error_response(e)
+        cache_answer(cache_key, response)
+        return response
+    
+    async def ready(response):
+        return response
+    
+    pending = deque()
+    position = 0
+    try:
+        for start in range(0, len(queries), settings.BATCH_RETRIEVAL_SIZE):
+            window = queries[start:start + settings.BATCH_RETRIEVAL_SIZE]
+            try:
+                # Serve cached answers, and only retrieve and generate for the rest
+                snapshot = get_snapshot()
+                cache_keys = await answer_cache_keys(window, snapshot)
+                cached = [lookup_cached_answer(key) for key in cache_keys]
+                misses = [i for i, response in enumerate(cached) if response is None]
+                retrieved = dict(zip(misses, await retrieve_for_queries([window[i] for i in misses], snapshot=snapshot)))
+                results = [
+                    ready(cached[i]) if cached[i] is not None else answer(query, *retrieved[i], cache_keys[i])
+                    for i, query in enumerate(window)
+                ]
+            except Exception as e:
+                results = [ready(error_response(e)) for _ in window]
+            pending.extend(asyncio.create_task(result) for result in results)
+            
+            # Hand out finished answers before retrieving the next window
+            while pending and pending[0].done():
+                yield position, pending.popleft().result()
+                position += 1
+        
+        while pending:
+            yield position, await pending.popleft()
+            position += 1
+    finally:
+        # The client went away; don't keep generating answers nobody reads
+        for task in pending:
+            task.cancel()
+
+async def stream_medical_query(query: str):
+    """Process a medical query, yielding (event, data) pairs as results become available.
+    
+    Emits "clinical_trials" as soon as retrieval finishes, then a "token" event
+    per piece of answer text as the model produces it, and finally "done" with
+    the full answer. Failures are reported as an "error" event.
+    """
+    if not await indices_available():
+        yield "error", {"detail": INDICES_UNAVAILABLE_ANSWER}
+        return
+    
+    try:
+        snapshot = get_snapshot()
+        context = expand_query(query)
+        cache_key = answer_cache_key(query, await context.aget_vector(), snapshot)
+        cached = lookup_cached_answer(cache_key)
+        if cached is not None:
+            # A cached answer is sent as a single token
+            yield "clinical_trials", {"clinical_trials": cached["clinical_trials"]}
+            yield "token", {"text": cached["answer"]}
+            yield "done", {"answer": cached["answer"]}
+            return
         
-        answer = completion.choices[0].message.content.strip()
+        prompt, clinical_trials = await retrieve_for_query(query, context=context, snapshot=snapshot)
+        yield "clinical_trials", {"clinical_trials": clinical_trials}
         
-        response = {
-            "answer": answer,
-            "clinical_trials": clinical_trials if is_requesting_trials else None
-        }
-        return response
+        with Span(LLM_SECONDS, model=CHAT_MODEL, mode="stream"):
+            stream = await get_async_client().chat.completions.create(
+                model=CHAT_MODEL,
+                temperature=0,
+                messages=build_messages(prompt),
+                stream=True,
+                # The last chunk then reports token usage
+                stream_options={"include_usage": True}
+            )
+            
+            parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text = chunk.choices[0].delta.content
+                    parts.append(text)
+                    yield "token", {"text": text}
+                count_llm_tokens(getattr(chunk, "usage", None))
+        
+        answer = "".join(parts).strip()
+        cache_answer(cache_key, {"answer": answer, "clinical_trials": clinical_trials})
+        yield "done", {"answer": answer}
     except Exception as e:
-        error_msg = f"Error processing query: {str(e)}"
-        print(error_msg)
-        return {
-            "answer": f"An error occurred while processing your query: {str(e)}",
-            "clinical_trials": None
-        }
+        logger.error("Error processing query", error=str(e))
+        yield "error", {"detail": f"An error occurred while processing your query: {str(e)}"}
 
 def construct_prompt(query, medical_context, clinical_trials=None):
     """Construct a prompt for the OpenAI API with available context."""
@@ -0,0 +1,101 @@
+import os
+import threading
+from app.utils.config import settings
+from app.utils.log import get_logger
+from app.utils.lru_cache import LRUCache
+from app.utils.term_matcher import TermMatcher
+
+logger = get_logger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+
+# Match categories
+CONDITION = "condition"
+MEDICAL_TERM = "term"
+TRIAL_REQUEST = "trial_request"
+TREATMENT = "treatment"
+
+# Built-in vocabulary; a vocabulary file adds to it
+CONDITION_TERMS = (
+    'diabetes', 'hypertension', 'blood pressure', 'cancer', 'arthritis',
+    'asthma', 'heart disease', 'obesity', 'depression', 'anxiety',
+    'alzheimer', 'parkinson', 'stroke', 'copd', 'allergies'
+)
+GENERAL_TERMS = ('pain', 'infection', 'disease', 'disorder', 'syndrome')
+TRIAL_REQUEST_TERMS = (
+    'clinical trial', 'trial', 'study',
+    'research study', 'research trial', 'participating', 'participate in',
+    'enroll in', 'treatment option', 'experimental treatment'
+)
+TREATMENT_TERMS = ('treatment', 'medication', 'therapy', 'options')
+# Other forms of built-in phrases; plural and possessive forms need no entry,
+# since the matcher normalizes them
+CONDITION_SYNONYMS = {'allergic': 'allergies'}
+
+_matcher = None
+_matcher_lock = threading.Lock()
+# Requests analyze the same query several times, so remember recent matches
+_query_matches = LRUCache(1024)
+
+def default_vocabulary():
+    """Yield the built-in (phrase, category, term) entries."""
+    for category, phrases in (
+        (CONDITION, CONDITION_TERMS),
+        (MEDICAL_TERM, GENERAL_TERMS),
+        (TRIAL_REQUEST, TRIAL_REQUEST_TERMS),
+        (TREATMENT, TREATMENT_TERMS),
+    ):
+        for phrase in phrases:
+            yield phrase, category, phrase
+    for phrase, term in CONDITION_SYNONYMS.items():
+        yield phrase, CONDITION, term
+
+def read_vocabulary(path):
+    """Yield (phrase, category, term) entries from a vocabulary file.
+
+    Each line holds a phrase, optionally followed by a tab-separated
+    category (default "condition") and canonical term (default the phrase
+    itself), e.g. "high blood pressure<TAB>condition<TAB>hypertension".
+    Blank lines and lines starting with "#" are skipped.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            fields = [field.strip() for field in line.rstrip("\n").split("\t")]
+            phrase = fields[0]
+            category = fields[1] if len(fields) > 1 and fields[1] else CONDITION
+            term = fields[2] if len(fields) > 2 and fields[2] else phrase
+            yield phrase, category, term
+
+def get_vocabulary_path():
+    """Get the vocabulary file path: the configured one, else data/medical_vocabulary.tsv."""
+    return settings.MEDICAL_VOCABULARY_PATH or os.path.join(DATA_DIR, 'medical_vocabulary.tsv')
+
+def get_term_matcher():
+    """Get the term matcher, compiling it from the vocabulary on first use."""
+    global _matcher
+    with _matcher_lock:
+        if _matcher is None:
+            entries = list(default_vocabulary())
+            path = get_vocabulary_path()
+            if os.path.exists(path):
+                entries.extend(read_vocabulary(path))
+                logger.info("Loaded medical vocabulary", path=path)
+            _matcher = TermMatcher(entries)
+            logger.info("Compiled term matcher", entries=len(_matcher))
+        return _matcher
+
+def match_terms(query):
+    """Find all vocabulary terms in a query, as TermMatch tuples ordered by position.
+
+    >>> [match.term for match in match_terms("Strokes and Alzheimer's run in my family")]
+    ['stroke', 'alzheimer']
+    >>> [match.term for match in match_terms("parkinsons, allergic reactions and joint pains")]
+    ['parkinson', 'allergies', 'pain']
+    """
+    matches = _query_matches.get(query)
+    if matches is None:
+        matches = tuple(get_term_matcher().find_all(query))
+        _query_matches.put(query, matches)
+    return matches
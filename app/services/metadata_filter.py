@@ -0,0 +1,97 @@
+import numpy as np
+from app.services.chunk_store import DELETED, TRIAL_ASPECTS
+from app.utils.lru_cache import LRUCache
+
+def normalize_value(value):
+    """Filter values match case-insensitively and ignore surrounding whitespace."""
+    return str(value).strip().lower()
+
+def canonical_filter(filters):
+    """Turn a filter into a hashable canonical form: sorted (field, sorted values) pairs."""
+    canonical = []
+    for field, values in filters.items():
+        if isinstance(values, (str, int, float)):
+            values = [values]
+        canonical.append((field, tuple(sorted({normalize_value(value) for value in values}))))
+    return tuple(sorted(canonical))
+
+def bitmap_contains(bitmap, rows):
+    """Test which rows are set in a packed bitmap (as built by FilterIndex.bitmap)."""
+    rows = np.asarray(rows, dtype='int64')
+    return ((bitmap[rows >> 3] >> (rows & 7)) & 1).astype(bool)
+
+def _group_rows(codes, num_values):
+    """Group rows by value code into CSR postings (indptr, rows); rows with code -1 are left out."""
+    rows = np.flatnonzero(codes >= 0)
+    order = np.argsort(codes[rows], kind='stable')
+    indptr = np.zeros(num_values + 1, dtype='int64')
+    np.cumsum(np.bincount(codes[rows], minlength=num_values), out=indptr[1:])
+    return indptr, rows[order]
+
+class FilterIndex:
+    """Chunk rows grouped by attribute value, for pre-filtered searches.
+
+    `fields` maps a field name to a function returning a document's value
+    for it (or None); every chunk of the document gets that value. The
+    chunk-level "aspect" field comes from the chunk store. Deleted chunks
+    match no filter.
+
+    A filter maps fields to a value or a list of values: a row matches if
+    it has one of the values of every field in the filter, e.g.
+    {"condition": ["diabetes", "hypertension"], "aspect": "eligibility"}.
+    """
+
+    def __init__(self, chunks, data, fields):
+        self.num_rows = len(chunks)
+        doc_ids = np.asarray(chunks.doc_ids, dtype='int64')
+        self._fields = {}
+        for field, get_value in fields.items():
+            values = {}
+            # One extra slot that DELETED (-1) indexes, so deleted chunks get no value
+            doc_codes = np.full(len(data) + 1, -1, dtype='int64')
+            for position, doc in enumerate(data):
+                value = get_value(doc) if doc is not None else None
+                if value is not None and value != "":
+                    doc_codes[position] = values.setdefault(normalize_value(value), len(values))
+            self._fields[field] = (values, *_group_rows(doc_codes[doc_ids], len(values)))
+
+        # Aspect code 0 means no aspect
+        aspect_codes = np.where(doc_ids != DELETED, np.asarray(chunks.aspects, dtype='int64') - 1, -1)
+        self._fields["aspect"] = ({aspect: code for code, aspect in enumerate(TRIAL_ASPECTS)},
+                                  *_group_rows(aspect_codes, len(TRIAL_ASPECTS)))
+        # Filters repeat a lot (e.g. one aspect), so keep recent bitmaps
+        self._bitmaps = LRUCache(64)
+
+    @property
+    def fields(self):
+        return tuple(self._fields)
+
+    def values(self, field):
+        """Get the (normalized) values present for a field."""
+        return tuple(self._fields[field][0])
+
+    def bitmap(self, filters):
+        """Get (bitmap, count) for a filter.
+
+        The bitmap has bit i of byte i >> 3 (least significant bit first)
+        set if row i matches, the layout FAISS's IDSelectorBitmap reads;
+        count is the number of matching rows. Raises ValueError for unknown
+        fields.
+        """
+        key = canonical_filter(filters)
+        cached = self._bitmaps.get(key)
+        if cached is None:
+            mask = np.ones(self.num_rows, dtype=bool)
+            for field, values in key:
+                if field not in self._fields:
+                    raise ValueError(f"Unknown filter field {field!r}, expected one of {', '.join(self._fields)}")
+                value_codes, indptr, rows = self._fields[field]
+                field_mask = np.zeros(self.num_rows, dtype=bool)
+                for value in values:
+                    code = value_codes.get(value)
+                    if code is not None:
+                        field_mask[rows[indptr[code]:indptr[code + 1]]] = True
+                mask &= field_mask
+            cached = (np.packbits(mask, bitorder='little'), int(np.count_nonzero(mask)))
+            self._bitmaps.put(key, cached)
+        return cached
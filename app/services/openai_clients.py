@@ -0,0 +1,12 @@
+from app.utils.config import settings
+
+# openai is imported on first use to keep application startup fast
+_async_client = None
+
+def get_async_client():
+    """Get the shared AsyncOpenAI client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=settings.OPENAI_KEY)
+    return _async_client
@@ -0,0 +1,18 @@
+from app.services.faiss_setup import aembed_query
+
+class QueryContext:
+    """A search query and its normalized embedding, computed at most once.
+
+    Create one per request and pass the result of aget_vector to every index
+    search so the query is embedded once no matter how many indices are searched.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._vector = None
+
+    async def aget_vector(self):
+        """Get the normalized query embedding, embedding the query on first use."""
+        if self._vector is None:
+            self._vector = await aembed_query(self.text)
+        return self._vector
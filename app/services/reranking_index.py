@@ -0,0 +1,50 @@
+import numpy as np
+
+class RerankingIndex:
+    """An index over lossy (quantized) codes whose results are re-scored exactly.
+
+    A search fetches `factor` times as many candidates from `index`, then
+    ranks them by their exact inner product with the query, computed from
+    the full-precision vectors in `vectors` (a VectorStore, usually
+    memory-mapped). Only the quantized codes need to fit in RAM. Row IDs
+    must be the VectorStore rows. Supports the parts of the FAISS index API
+    the services use.
+    """
+
+    def __init__(self, index, vectors, factor):
+        self.index = index
+        self.vectors = vectors
+        self.factor = max(1, factor)
+        self.d = index.d
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def is_trained(self):
+        return self.index.is_trained
+
+    def add_with_ids(self, vectors, ids):
+        ids = np.asarray(ids, dtype='int64')
+        if len(ids) and (ids[0] != len(self.vectors) or np.any(np.diff(ids) != 1)):
+            raise ValueError("Vectors must be added with consecutive IDs following the stored ones")
+        self.index.add_with_ids(vectors, ids)
+        self.vectors = self.vectors.updated(vectors)
+
+    def remove_ids(self, ids):
+        return self.index.remove_ids(ids)
+
+    def search(self, x, k, params=None):
+        x = np.ascontiguousarray(x, dtype='float32')
+        _, candidates = self.index.search(x, k * self.factor, params=params)
+        distances = np.full((len(x), k), -np.inf, dtype='float32')
+        ids = np.full((len(x), k), -1, dtype='int64')
+        # One query at a time keeps the gathered vectors small
+        for i, query_candidates in enumerate(candidates):
+            query_candidates = query_candidates[query_candidates >= 0]
+            scores = self.vectors.get(query_candidates) @ x[i]
+            top = np.argsort(-scores, kind='stable')[:k]
+            distances[i, :len(top)] = scores[top]
+            ids[i, :len(top)] = query_candidates[top]
+        return distances, ids
@@ -0,0 +1,82 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from app.utils.config import settings
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def limit_faiss_threads(threads):
+    """Cap the OpenMP threads FAISS uses for searches run from the calling thread (0 keeps the default).
+
+    OpenMP settings are per thread, so search pools call this from each
+    worker thread as it starts.
+    """
+    if threads:
+        faiss.omp_set_num_threads(threads)
+
+def get_shard_executor():
+    """Get the thread pool that searches shards, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHARD_SEARCH_THREADS or os.cpu_count(),
+                thread_name_prefix="faiss-shard",
+                # Parallelism comes from searching shards side by side, so each search uses one core by default
+                initializer=limit_faiss_threads,
+                initargs=(settings.FAISS_OMP_THREADS or 1,)
+            )
+        return _executor
+
+class ShardedIndex:
+    """Several FAISS indices (shards) searched in parallel as one inner-product index.
+
+    A vector with ID i lives in shard i % len(shards), and every shard keeps
+    the original IDs, so results, ID selectors and removals need no
+    translation. A search runs on all shards at once in a shared thread
+    pool (at most SHARD_SEARCH_THREADS shard searches run at a time across
+    all requests) and the per-shard top-k lists are merged with a top-k
+    heap. Supports the parts of the FAISS index API the services use.
+    """
+
+    def __init__(self, shards):
+        self.shards = list(shards)
+        self.d = self.shards[0].d
+
+    @property
+    def ntotal(self):
+        return sum(shard.ntotal for shard in self.shards)
+
+    @property
+    def is_trained(self):
+        return all(shard.is_trained for shard in self.shards)
+
+    def _shard_of(self, ids):
+        return np.asarray(ids, dtype='int64') % len(self.shards)
+
+    def add_with_ids(self, vectors, ids):
+        ids = np.asarray(ids, dtype='int64')
+        shard_of = self._shard_of(ids)
+        for i, shard in enumerate(self.shards):
+            mask = shard_of == i
+            if mask.any():
+                shard.add_with_ids(np.ascontiguousarray(vectors[mask]), ids[mask])
+
+    def remove_ids(self, ids):
+        ids = np.asarray(ids, dtype='int64')
+        shard_of = self._shard_of(ids)
+        return sum(shard.remove_ids(ids[shard_of == i]) for i, shard in enumerate(self.shards))
+
+    def search(self, x, k, params=None):
+        x = np.ascontiguousarray(x, dtype='float32')
+        executor = get_shard_executor()
+        futures = [executor.submit(shard.search, x, k, params=params) for shard in self.shards]
+        heap = faiss.ResultHeap(len(x), k, keep_max=True)
+        for future in futures:
+            distances, ids = future.result()
+            heap.add_result(distances, ids)
+        heap.finalize()
+        return heap.D, heap.I
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+class VectorStore:
+    """Full-precision float32 vectors by row (row i is the chunk with FAISS ID i).
+
+    Vectors are memory-mapped from raw float32 files, so only the rows
+    actually read are paged into memory. Never modified once built;
+    updates append a segment and return a new store.
+    """
+
+    __slots__ = ("dimension", "_segments")
+
+    def __init__(self, dimension, segments):
+        self.dimension = dimension
+        # Arrays of consecutive rows, in row order
+        self._segments = tuple(segments)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments)
+
+    @property
+    def nbytes(self):
+        return len(self) * self.dimension * 4
+
+    def get(self, rows):
+        """Get the vectors of the given rows as an (n, d) array."""
+        rows = np.asarray(rows, dtype='int64')
+        if len(self._segments) == 1:
+            return np.asarray(self._segments[0][rows])
+        vectors = np.empty((len(rows), self.dimension), dtype='float32')
+        start = 0
+        for segment in self._segments:
+            in_segment = (rows >= start) & (rows < start + len(segment))
+            vectors[in_segment] = segment[rows[in_segment] - start]
+            start += len(segment)
+        return vectors
+
+    def updated(self, new_vectors):
+        """Return a copy with vectors appended as the next rows; existing segments are shared."""
+        if len(new_vectors) == 0:
+            return self
+        return VectorStore(self.dimension, self._segments + (np.array(new_vectors, dtype='float32'),))
+
+    def save(self, directory, block_size=65536):
+        """Write the store to a directory as one raw float32 file."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "vectors.f32"), "wb") as f:
+            for segment in self._segments:
+                for start in range(0, len(segment), block_size):
+                    f.write(memoryview(np.ascontiguousarray(segment[start:start + block_size], dtype='float32')))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"dimension": self.dimension, "rows": len(self)}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Load a store written by save(), memory-mapping its vectors."""
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        shape = (meta["rows"], meta["dimension"])
+        if meta["rows"] == 0:
+            return cls(meta["dimension"], [np.zeros(shape, dtype='float32')])
+        vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype='float32', mode='r', shape=shape)
+        return cls(meta["dimension"], [vectors])
+
+class VectorStoreBuilder:
+    """Streams vectors to an anonymous temporary file, then maps it as a VectorStore.
+
+    The file is already unlinked, so it disappears once the store is no
+    longer used; saving a snapshot writes a permanent copy.
+    """
+
+    def __init__(self, directory=None):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.TemporaryFile(dir=directory or None)
+        self.dimension = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, vectors):
+        """Append vectors as the next rows."""
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        self.dimension = vectors.shape[1]
+        self._file.write(memoryview(vectors))
+        self.count += len(vectors)
+
+    def build(self):
+        """Return the finished VectorStore."""
+        self._file.flush()
+        if self.count == 0:
+            return VectorStore(self.dimension or 0, [np.zeros((0, self.dimension or 0), dtype='float32')])
+        vectors = np.memmap(self._file, dtype='float32', mode='r', shape=(self.count, self.dimension))
+        return VectorStore(self.dimension, [vectors])
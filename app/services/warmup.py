@@ -0,0 +1,68 @@
+import threading
+import time
+from app.utils.log import get_logger
+
+# Keep this module free of heavy imports (faiss, numpy, openai): it is
+# imported at application startup, before the indices are available.
+
+logger = get_logger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+_state = {
+    "phase": "pending",
+    "started_at": None,
+    "finished_at": None,
+    "steps_completed": [],
+    "error": None,
+}
+
+def _set_phase(phase):
+    with _lock:
+        if _state["phase"] not in ("pending", "ready", "failed"):
+            _state["steps_completed"].append(_state["phase"])
+        _state["phase"] = phase
+    logger.info("Warm-up phase", phase=phase)
+
+def _run():
+    """Import the index services and load or build the indices."""
+    try:
+        _set_phase("importing")
+        from app.services import faiss_setup
+
+        status = faiss_setup.load_or_build_indices(progress=_set_phase)
+        if "error" in status:
+            raise RuntimeError(status["error"])
+        _set_phase("ready")
+    except Exception as e:
+        logger.exception("Warm-up failed", error=str(e))
+        with _lock:
+            _state["error"] = str(e)
+        _set_phase("failed")
+    finally:
+        with _lock:
+            _state["finished_at"] = time.time()
+
+def start_warmup():
+    """Start loading indices in a background thread (no-op if already started)."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _state["started_at"] = time.time()
+        _thread = threading.Thread(target=_run, name="index-warmup", daemon=True)
+    _thread.start()
+
+def is_warming_up():
+    """Whether warm-up has started and not yet finished."""
+    return _state["phase"] not in ("pending", "ready", "failed")
+
+def get_warmup_status():
+    """Get a snapshot of the warm-up progress."""
+    with _lock:
+        status = dict(_state)
+        status["steps_completed"] = list(_state["steps_completed"])
+    end = status["finished_at"] or time.time()
+    status["elapsed_seconds"] = round(end - status["started_at"], 3) if status["started_at"] else 0.0
+    status["ready"] = status["phase"] == "ready"
+    return status
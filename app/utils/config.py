@@ -1,9 +1,109 @@
+from typing import Dict
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     OPENAI_KEY: str
 
+    # Embedder: openai, hashing (local, deterministic) or sentence_transformers (local model)
+    EMBEDDER: str = "openai"
+    OPENAI_EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    # Shortened embeddings for models that support them (text-embedding-3-*; 0 keeps the full size)
+    OPENAI_EMBEDDING_DIMENSIONS: int = 0
+    HASHING_EMBEDDING_DIM: int = 1024
+    LOCAL_EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+
+    # Bulk embedding used by index builds
+    EMBEDDING_BATCH_SIZE: int = 512
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    # Embedding rate limit of the API account in tokens per minute (0: don't throttle), and the
+    # share of it index builds and updates may use, so queries keep the rest
+    EMBEDDING_TOKENS_PER_MINUTE: int = 0
+    BUILD_EMBEDDING_RATE_SHARE: float = 0.5
+
+    # Corpus files, JSON arrays or JSONL (default: data/<name>.jsonl, else .json)
+    MEDICAL_DATA_PATH: str = ""
+    CLINICAL_TRIALS_DATA_PATH: str = ""
+    # Chunks embedded and added to the index per step when building
+    INGEST_BATCH_SIZE: int = 4096
+
+    # Extra medical vocabulary, one term per line (default: data/medical_vocabulary.tsv)
+    MEDICAL_VOCABULARY_PATH: str = ""
+
+    # On-disk embedding cache, one subdirectory per embedder (defaults to data/embedding_cache)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: str = ""
+
+    # On-disk index snapshots (defaults to data/indices)
+    INDEX_DIR: str = ""
+    INDEX_SNAPSHOTS_KEPT: int = 2
+
+    # Recent query embeddings kept in memory
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+
+    # Semantic answer cache: reuse the answer of a near-identical earlier query
+    # (cosine similarity >= threshold) on the same index version. Off by default
+    # because similar wording can still call for a different answer.
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_SIZE: int = 1000
+    ANSWER_CACHE_THRESHOLD: float = 0.97
+    ANSWER_CACHE_TTL: int = 86400  # seconds
+    ANSWER_CACHE_PATH: str = ""  # optional JSONL file to persist entries (embeddings and answers, no query text)
+
+    # Threads used to run FAISS searches off the event loop
+    SEARCH_THREADS: int = 4
+    # OpenMP threads each of those threads may use per search (0: FAISS default)
+    FAISS_OMP_THREADS: int = 0
+
+    # Split each index into this many shards, searched in parallel by
+    # SHARD_SEARCH_THREADS threads shared by all requests (0: one per CPU core)
+    INDEX_SHARDS: int = 1
+    SHARD_SEARCH_THREADS: int = 0
+
+    # /analyze/batch: queries per retrieval pass and concurrent LLM completions
+    BATCH_MAX_QUERIES: int = 10000
+    BATCH_RETRIEVAL_SIZE: int = 256
+    BATCH_LLM_CONCURRENCY: int = 8
+
+    # FAISS index type: flat, ivf_flat, ivf_pq, hnsw, sq8 or fp16
+    INDEX_TYPE: str = "flat"
+    INDEX_TRAIN_SAMPLE_SIZE: int = 100000
+    IVF_NLIST: int = 0  # 0 picks about 4*sqrt(number of training vectors)
+    IVF_NPROBE: int = 16
+    PQ_M: int = 64
+    PQ_NBITS: int = 8
+    HNSW_M: int = 32
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 128
+    # Project vectors to this many dimensions (uncentered PCA fitted at build time; 0 keeps them)
+    REDUCED_DIMENSION: int = 0
+    # Lossy types (ivf_pq, sq8, fp16) and reduced indices fetch this many times more candidates and
+    # re-rank them against full-precision vectors kept on disk (0 disables)
+    RERANK_FACTOR: int = 4
+
+    # How chunk scores combine into a trial score: max, sum or weighted (by aspect)
+    TRIAL_SCORE_AGGREGATION: str = "max"
+    TRIAL_ASPECT_WEIGHTS: Dict[str, float] = {
+        "title": 1.0, "condition": 1.5, "intervention": 1.0, "eligibility": 0.5, "full": 1.0
+    }
+    # Upper bound on chunks fetched while looking for enough distinct trials
+    GROUPED_SEARCH_MAX_K: int = 1000
+
+    # Hybrid search: fuse BM25 keyword results with vector results (reciprocal rank fusion)
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_CANDIDATES: int = 20  # documents taken from each retriever before fusing
+    RRF_K: int = 60
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+
+    # Logs go to stderr as JSON lines ("json") or plain text ("text")
+    LOG_FORMAT: str = "json"
+    LOG_LEVEL: str = "INFO"
+
+    # Recall@k against flat search, measured at build time
+    RECALL_EVAL_QUERIES: int = 200
+    RECALL_EVAL_K: int = 10
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -0,0 +1,73 @@
+import json
+import logging
+import sys
+import threading
+import time
+from app.utils.config import settings
+
+_configured = False
+_configure_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the event's fields."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines, with the event's fields as key=value pairs."""
+
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + fields
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger taking an event's fields as keyword arguments.
+
+        logger.info("Built index", corpus="medical", chunks=1200)
+
+    Fields are emitted as separate keys (JSON) or key=value pairs (text)
+    rather than formatted into the message, so logs can be queried by them.
+    """
+
+    # Keyword arguments that belong to logging itself rather than the event
+    RESERVED = ("exc_info", "stack_info", "stacklevel", "extra")
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        kwargs.setdefault("extra", {})["fields"] = fields
+        return msg, kwargs
+
+def configure_logging():
+    """Send the application's logs to stderr in the configured LOG_FORMAT, once."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+        logger = logging.getLogger("app")
+        logger.addHandler(handler)
+        logger.setLevel(settings.LOG_LEVEL.upper())
+        # Uvicorn configures the root logger; don't log everything twice
+        logger.propagate = False
+        _configured = True
+
+def get_logger(name):
+    """Get a structured logger for a module (pass __name__)."""
+    configure_logging()
+    return StructuredLogger(logging.getLogger(name), {})
@@ -0,0 +1,162 @@
+import bisect
+import math
+import threading
+import time
+from app.utils.log import get_logger
+
+# Latency buckets in seconds, from sub-millisecond index searches to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+logger = get_logger(__name__)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Metric:
+    """A named metric with a fixed set of label names, registered for /metrics.
+
+    Values are kept per combination of label values, passed as keyword
+    arguments (e.g. counter.inc(corpus="medical")). Thread-safe.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        """Yield (suffix, label values, extra label pairs, value) for every sample."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, values, extra, value in samples:
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for values, value in sorted(self._values.items()):
+            yield "_total", values, (), value
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. the size of an index."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def _samples(self):
+        for values, value in sorted(self._values.items()):
+            yield "", values, (), value
+
+class Histogram(Metric):
+    """Observed values (usually durations in seconds) counted in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last is +Inf), then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def _samples(self):
+        for values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", values, (("le", _format_value(float(bound))),), cumulative
+            yield "_sum", values, (), total
+            yield "_count", values, (), cumulative
+
+class Span:
+    """Time a block into a histogram, and log it at debug level.
+
+        with Span(INDEX_SEARCH_SECONDS, corpus="medical", retriever="vector"):
+            index.search(...)
+
+    The duration is recorded even if the block raises.
+    """
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self.histogram.observe(self.seconds, **self.labels)
+        logger.debug("Span finished", span=self.histogram.name, duration_ms=round(self.seconds * 1000, 3),
+                     failed=exc_type is not None, **self.labels)
+        return False
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
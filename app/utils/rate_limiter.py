@@ -0,0 +1,31 @@
+import threading
+import time
+
+class RateLimiter:
+    """A token bucket limiting an average rate of units (e.g. API tokens) per second.
+
+    acquire() reserves units and sleeps until they are available, in
+    call order. A request larger than the bucket still goes through, and
+    the callers after it wait correspondingly longer, so the average rate
+    holds. Thread-safe.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        # At most one second's worth can be used in a burst by default
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        """Take `amount` units, sleeping until the rate allows. Returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= amount
+            wait = -self._level / self.rate if self._level < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
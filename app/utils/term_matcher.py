@@ -0,0 +1,134 @@
+import re
+from collections import deque, namedtuple
+
+WORD_PATTERN = re.compile(r"\w+")
+# Words as matched against a vocabulary, keeping a possessive "'s"
+MATCH_WORD_PATTERN = re.compile(r"\w+(?:['\u2019]s\b)?")
+# Plural endings that are part of the word, e.g. "illness", "virus", "arthritis"
+_NOT_PLURAL = ("ss", "us", "is")
+
+TermMatch = namedtuple("TermMatch", ["start", "end", "text", "term", "category"])
+
+def _lower(text):
+    """Lowercase text without changing its length, so match spans stay valid."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        lowered = "".join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+    return lowered
+
+def tokenize(text):
+    """Split text into lowercase words."""
+    return WORD_PATTERN.findall(_lower(text))
+
+def normalize_word(word):
+    """Strip a lowercase word's possessive or simple plural suffix ("'s", "s", "es", "ies").
+
+    Vocabulary phrases and text are normalized alike, so singular, plural
+    and possessive forms match each other.
+
+    >>> [normalize_word(word) for word in ("strokes", "alzheimer's", "parkinsons", "pains", "therapies")]
+    ['stroke', 'alzheimer', 'parkinson', 'pain', 'therapy']
+    >>> [normalize_word(word) for word in ("illnesses", "rashes", "arthritis", "painful")]
+    ['illness', 'rash', 'arthritis', 'painful']
+    """
+    if word.endswith(("'s", "\u2019s")):
+        return word[:-2]
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(_NOT_PLURAL):
+        return word[:-1]
+    return word
+
+def match_words(text):
+    """Yield (start, end, normalized word) for each word of a text, as the matcher sees them."""
+    for word_match in MATCH_WORD_PATTERN.finditer(_lower(text)):
+        yield word_match.start(), word_match.end(), normalize_word(word_match.group())
+
+class TermMatcher:
+    """Aho-Corasick automaton that finds vocabulary phrases in text in one pass.
+
+    Phrases are matched as whole words, case-insensitively, ignoring the
+    punctuation and spacing between words. Plural and possessive suffixes
+    are normalized away (see normalize_word), so "Alzheimer's" and
+    "alzheimers" match the phrase "alzheimer" and "pains" matches "pain",
+    but "painful" doesn't. The automaton
+    runs over words rather than characters, which keeps it small for large
+    vocabularies. find_all visits each word of the text once, so its cost
+    is linear in the text length (plus the number of matches) no matter
+    how many phrases there are.
+    """
+
+    def __init__(self, entries):
+        """Build the automaton from (phrase, category, term) entries.
+
+        `term` is the canonical name reported for matches of the phrase,
+        which lets synonyms map to one term.
+        """
+        self._goto = {}
+        self._fail = [0]
+        self._outputs = [[]]
+        self._entries = []
+        children = [[]]
+
+        seen = set()
+        for phrase, category, term in entries:
+            words = [word for _, _, word in match_words(phrase)]
+            if not words or (tuple(words), category, term) in seen:
+                continue
+            seen.add((tuple(words), category, term))
+
+            state = 0
+            for word in words:
+                child = self._goto.get((state, word))
+                if child is None:
+                    child = len(self._fail)
+                    self._goto[(state, word)] = child
+                    self._fail.append(0)
+                    self._outputs.append([])
+                    children.append([])
+                    children[state].append((word, child))
+                state = child
+            self._outputs[state].append(len(self._entries))
+            self._entries.append((len(words), term, category))
+
+        self._link(children)
+
+    def _link(self, children):
+        """Compute failure links breadth-first and merge each state's matches with its fallback's."""
+        queue = deque(child for _, child in children[0])
+        while queue:
+            state = queue.popleft()
+            for word, child in children[state]:
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and (fallback, word) not in self._goto:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto.get((fallback, word), 0)
+                if self._outputs[self._fail[child]]:
+                    self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def find_all(self, text):
+        """Return every vocabulary match in the text, including overlapping ones, ordered by position."""
+        matches = []
+        word_starts = []
+        state = 0
+        for word_start, word_end, word in match_words(text):
+            word_starts.append(word_start)
+            while state and (state, word) not in self._goto:
+                state = self._fail[state]
+            state = self._goto.get((state, word), 0)
+
+            for entry in self._outputs[state]:
+                length, term, category = self._entries[entry]
+                start, end = word_starts[-length], word_end
+                matches.append(TermMatch(start, end, text[start:end], term, category))
+
+        matches.sort(key=lambda match: (match.start, match.end))
+        return matches
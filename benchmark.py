@@ -0,0 +1,242 @@
+"""Offline retrieval benchmark for MedFlow.
+
+Generates synthetic medical documents and clinical trials, indexes them
+with the deterministic hashing embedder (no OpenAI calls), and measures
+build time, peak memory, search latency and recall against flat search.
+
+    python benchmark.py --sizes 1000,10000,100000 --index-types flat,hnsw,sq8 --output bench.json
+
+Each (size, index type) pair runs in a fresh process so its peak RSS is its
+own. Sizes are chunks per corpus. Other settings (INDEX_SHARDS,
+HYBRID_SEARCH_ENABLED, IVF_NPROBE, ...) are read from the environment as
+usual. The JSON output is meant to be compared across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+CONDITIONS = [
+    "Type 2 Diabetes", "Hypertension", "Asthma", "COPD", "Heart Failure", "Atrial Fibrillation",
+    "Chronic Kidney Disease", "Rheumatoid Arthritis", "Osteoarthritis", "Migraine", "Epilepsy",
+    "Major Depressive Disorder", "Generalized Anxiety Disorder", "Alzheimer's Disease", "Parkinson's Disease",
+    "Multiple Sclerosis", "Psoriasis", "Crohn's Disease", "Ulcerative Colitis", "Hepatitis C",
+    "HIV Infection", "Breast Cancer", "Lung Cancer", "Prostate Cancer", "Obesity", "Osteoporosis",
+    "Hypothyroidism", "Sleep Apnea", "Gout", "Anemia",
+]
+INTERVENTIONS = [
+    "Metformin", "Insulin Therapy", "Calcium Channel Blocker", "ACE Inhibitor", "Beta Blocker",
+    "Inhaled Corticosteroid", "Long-acting Bronchodilator", "Monoclonal Antibody", "Statin Therapy",
+    "Cognitive Behavioral Therapy", "Physical Therapy", "Dietary Intervention", "Exercise Program",
+    "Gene Therapy", "Immunotherapy", "Radiation Therapy", "Anticoagulant", "SGLT2 Inhibitor",
+    "GLP-1 Receptor Agonist", "Vitamin D Supplementation",
+]
+SYMPTOMS = [
+    "fatigue", "chest pain", "shortness of breath", "frequent urination", "joint pain", "headache",
+    "blurred vision", "weight loss", "weight gain", "dizziness", "nausea", "swelling", "insomnia",
+    "persistent cough", "memory loss", "tremor", "rash", "abdominal pain", "fever", "palpitations",
+]
+DOC_TYPES = ["chronic", "acute", "infectious", "genetic", "lifestyle"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "to", "vi", "zu", "pe", "sa", "di", "fo", "gu", "ha", "ju"]
+
+def make_words(rng, count):
+    """Make a vocabulary of pronounceable filler words, so corpora aren't just the lists above."""
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def synthetic_medical_docs(count, seed=0):
+    """Yield `count` medical documents, each short enough to be a single chunk."""
+    rng = random.Random(seed)
+    words = make_words(rng, 5000)
+    for i in range(count):
+        condition = rng.choice(CONDITIONS)
+        symptoms = ", ".join(rng.sample(SYMPTOMS, 2))
+        filler = " ".join(rng.choices(words, k=6))
+        content = f"{condition} may cause {symptoms}. Treated with {rng.choice(INTERVENTIONS)}. {filler}"
+        yield {
+            "id": f"SYN-DOC-{i}",
+            "content": content[:200],
+            "metadata": {"condition": condition, "type": rng.choice(DOC_TYPES)},
+        }
+
+def synthetic_clinical_trials(count, seed=1):
+    """Yield `count` clinical trials (five chunks each)."""
+    rng = random.Random(seed)
+    words = make_words(rng, 5000)
+    for i in range(count):
+        condition = rng.choice(CONDITIONS)
+        intervention = rng.choice(INTERVENTIONS)
+        yield {
+            "id": f"SYN-TRIAL-{i}",
+            "title": f"{intervention} for {condition}: {' '.join(rng.choices(words, k=3))} study",
+            "condition": condition,
+            "intervention": intervention,
+            "eligibility": f"Adults aged {rng.randint(18, 40)}-{rng.randint(50, 80)} with {condition} and {rng.choice(SYMPTOMS)}",
+        }
+
+def synthetic_queries(count, seed=2):
+    """Make `count` distinct patient-style queries."""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        queries.append(
+            f"{rng.choice(SYMPTOMS)} and {rng.choice(SYMPTOMS)}, history of {rng.choice(CONDITIONS)}, "
+            f"considering {rng.choice(INTERVENTIONS)} (case {i})"
+        )
+    return queries
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def latency_summary(seconds):
+    """p50/p95/p99 and mean of a list of durations, in milliseconds."""
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+    }
+
+def run_one(size, index_type, num_queries, k):
+    """Build both corpora at one size and index type in this process, and measure them."""
+    from app.services import faiss_setup
+    from app.services.index_snapshot import IndexSnapshot
+    from app.utils.config import settings
+
+    settings.INDEX_TYPE = index_type
+    result = {"chunks": size, "index_type": index_type}
+    built = {}
+    for corpus, docs in (("medical", synthetic_medical_docs(size)),
+                         ("clinical_trials", synthetic_clinical_trials(max(1, size // 5)))):
+        start = time.perf_counter()
+        built[corpus] = faiss_setup.build_corpus_index(corpus, docs)
+        result[corpus] = {
+            "chunks": len(built[corpus].chunks),
+            "build_seconds": round(time.perf_counter() - start, 3),
+            "index_report": built[corpus].report,
+        }
+    snapshot = IndexSnapshot(built["medical"], built["clinical_trials"])
+
+    queries = synthetic_queries(num_queries)
+    vectors = [faiss_setup.embed_query(query) for query in queries]
+    searches = {
+        "medical": lambda query, vector: faiss_setup.search_medical_knowledge(query, k=k, query_vector=vector, snapshot=snapshot),
+        "clinical_trials": lambda query, vector: faiss_setup.search_clinical_trials(query, n=k, query_vector=vector, snapshot=snapshot),
+    }
+    for corpus, search in searches.items():
+        # Warm up (lazily built structures, caches, thread pools)
+        for query, vector in zip(queries[:5], vectors[:5]):
+            search(query, vector)
+        durations, results = [], []
+        for query, vector in zip(queries, vectors):
+            start = time.perf_counter()
+            docs = search(query, vector)
+            durations.append(time.perf_counter() - start)
+            results.append([doc["id"] for doc in docs])
+        result[corpus]["latency_ms"] = latency_summary(durations)
+        result[corpus]["results"] = results
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def recall(results, baseline):
+    """Mean fraction of the baseline's results each query also returned."""
+    overlaps = [len(set(found) & set(expected)) / len(expected) for found, expected in zip(results, baseline) if expected]
+    return round(sum(overlaps) / len(overlaps), 4) if overlaps else 1.0
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_child(args, size, index_type, work_dir):
+    """Run one measurement in a fresh interpreter and return its result."""
+    command = [sys.executable, os.path.abspath(__file__), "--run-one", str(size), "--index-types", index_type,
+               "--queries", str(args.queries), "--k", str(args.k), "--dimension", str(args.dimension)]
+    env = dict(os.environ, INDEX_DIR=os.path.join(work_dir, f"{index_type}-{size}"))
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark of {index_type} at {size} chunks failed:\n{completed.stderr}")
+    # Logs go to stderr, so stdout holds only the JSON result (the last line, to be safe)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline MedFlow retrieval benchmark (synthetic data, local embedder)")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated chunks per corpus (up to 1000000)")
+    parser.add_argument("--index-types", default="flat,hnsw,sq8", help="comma-separated INDEX_TYPE values; flat is the recall baseline")
+    parser.add_argument("--queries", type=int, default=200, help="queries timed per corpus")
+    parser.add_argument("--k", type=int, default=4, help="results per search")
+    parser.add_argument("--dimension", type=int, default=256, help="hashing embedder dimension")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Everything runs offline: the hashing embedder, no disk cache for its vectors
+    os.environ["EMBEDDER"] = "hashing"
+    os.environ["HASHING_EMBEDDING_DIM"] = str(args.dimension)
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("OPENAI_KEY", "offline-benchmark")
+    index_types = [index_type for index_type in args.index_types.split(",") if index_type]
+
+    if args.run_one is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(run_one(args.run_one, index_types[0], args.queries, args.k)))
+        return
+
+    # Flat goes first at every size, since the other types are compared with it
+    if "flat" not in index_types:
+        index_types.insert(0, "flat")
+    index_types.sort(key=lambda index_type: index_type != "flat")
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="medflow-bench-") as work_dir:
+        for size in (int(size) for size in args.sizes.split(",") if size):
+            baseline = None
+            for index_type in index_types:
+                print(f"Benchmarking {index_type} at {size} chunks per corpus...", file=sys.stderr)
+                result = run_child(args, size, index_type, work_dir)
+                if baseline is None:
+                    baseline = result
+                for corpus in ("medical", "clinical_trials"):
+                    result[corpus]["recall_vs_flat"] = recall(result[corpus]["results"], baseline[corpus]["results"])
+                runs.append(result)
+    for result in runs:
+        for corpus in ("medical", "clinical_trials"):
+            del result[corpus]["results"]
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "embedder": f"hashing-{args.dimension}",
+        "queries": args.queries,
+        "k": args.k,
+        "runs": runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ BASE_URL = "http://localhost:8000"
 
 def build_indices():
     """Build FAISS indices to ensure they're ready for testing"""
-    response = requests.post(f"{BASE_URL}/indices/rebuild")
+    response = requests.post(f"{BASE_URL}/indices/rebuild", params={"wait": "true"})
     if response.status_code == 200:
         print("Indices built successfully")
         return True